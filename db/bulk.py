@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+import bson
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on operations per bulk_write; the server's maxWriteBatchSize caps it further
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+# Upper bound on encoded document bytes per bulk_write, below the 48MB message limit
+BULK_CHUNK_BYTES = int(os.getenv("BULK_CHUNK_BYTES", str(8 * 1024 * 1024)))
+# Number of chunks written at the same time
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "4"))
+
+# Server limits from the hello command, read once per process
+_server_limits: Optional[Dict[str, int]] = None
+
+
+class BulkWriteSummary:
+    """
+    Counts aggregated over every chunk of a chunked bulk write.
+    """
+
+    def __init__(self):
+        self.inserted_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.upserted_count = 0
+        self.error_count = 0
+        self.chunks = 0
+
+    def add_result(self, result) -> None:
+        self.inserted_count += result.inserted_count
+        self.matched_count += result.matched_count
+        self.modified_count += result.modified_count
+        self.upserted_count += result.upserted_count
+
+    def add_error(self, error: BulkWriteError) -> None:
+        details = error.details
+        self.inserted_count += details.get("nInserted", 0)
+        self.matched_count += details.get("nMatched", 0)
+        self.modified_count += details.get("nModified", 0)
+        self.upserted_count += details.get("nUpserted", 0)
+        self.error_count += len(details.get("writeErrors", []))
+
+    def merge(self, other: "BulkWriteSummary") -> None:
+        for name in ("inserted_count", "matched_count", "modified_count",
+                     "upserted_count", "error_count", "chunks"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(vars(self))
+
+    def __repr__(self):
+        return f"BulkWriteSummary({self.as_dict()})"
+
+
+async def server_limits(collection: AsyncIOMotorCollection) -> Dict[str, int]:
+    """
+    Returns the server's maxWriteBatchSize and maxBsonObjectSize, cached after the first
+    successful call. Falls back to the server defaults while the server can't be reached.
+    """
+    global _server_limits
+    if _server_limits is None:
+        try:
+            hello = await collection.database.command("hello")
+        except Exception as e:
+            # Not cached, so the next write asks again; the write itself reports the outage
+            logger.warning(f"Could not read server limits, using the defaults: {e}")
+            hello = None
+        limits = {
+            "max_write_batch_size": (hello or {}).get("maxWriteBatchSize", 100_000),
+            "max_bson_object_size": (hello or {}).get("maxBsonObjectSize", 16 * 1024 * 1024),
+        }
+        if hello is None:
+            return limits
+        _server_limits = limits
+    return _server_limits
+
+
+def chunk_documents(documents: List[Dict[str, Any]], max_count: int,
+                    max_bytes: int) -> List[List[Dict[str, Any]]]:
+    """
+    Splits documents into chunks of at most max_count documents and roughly max_bytes
+    of encoded BSON. A single document larger than max_bytes gets a chunk of its own.
+    """
+    chunks: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    current_bytes = 0
+    for document in documents:
+        size = len(bson.encode(document))
+        if current and (len(current) >= max_count or current_bytes + size > max_bytes):
+            chunks.append(current)
+            current, current_bytes = [], 0
+        current.append(document)
+        current_bytes += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def _run_chunks(collection: AsyncIOMotorCollection, chunks: List[List[Any]],
+                      concurrency: int) -> BulkWriteSummary:
+    """
+    Runs one unordered bulk_write per chunk, at most `concurrency` at a time.
+    """
+    summary = BulkWriteSummary()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def write(operations: List[Any]):
+        async with semaphore:
+            try:
+                summary.add_result(await collection.bulk_write(operations, ordered=False))
+            except BulkWriteError as e:
+                summary.add_error(e)
+                logger.error(
+                    f"{len(e.details.get('writeErrors', []))} of {len(operations)} writes to "
+                    f"'{collection.name}' failed: {e.details.get('writeErrors', [])[:1]}")
+            except Exception:
+                summary.error_count += len(operations)
+                logger.exception(
+                    f"Bulk write of {len(operations)} operations to '{collection.name}' failed")
+            summary.chunks += 1
+
+    await asyncio.gather(*(write(operations) for operations in chunks))
+    return summary
+
+
+async def _chunk(collection: AsyncIOMotorCollection, documents: List[Dict[str, Any]],
+                 chunk_size: int) -> List[List[Dict[str, Any]]]:
+    limits = await server_limits(collection)
+    return chunk_documents(documents, min(chunk_size, limits["max_write_batch_size"]),
+                           BULK_CHUNK_BYTES)
+
+
+async def bulk_upsert(collection: AsyncIOMotorCollection, documents: List[Dict[str, Any]],
+                      key: str, chunk_size: int = BULK_CHUNK_SIZE,
+                      concurrency: int = BULK_CONCURRENCY) -> BulkWriteSummary:
+    """
+    Upserts documents keyed on the natural ID field `key` ($set of the whole document),
+    in concurrent unordered chunks. Returns the aggregated counts.
+    """
+    if not documents:
+        return BulkWriteSummary()
+    chunks = await _chunk(collection, documents, chunk_size)
+    operations = [
+        [UpdateOne({key: document[key]}, {"$set": document}, upsert=True)
+         for document in chunk]
+        for chunk in chunks
+    ]
+    return await _run_chunks(collection, operations, concurrency)
+
+
+async def bulk_insert(collection: AsyncIOMotorCollection, documents: List[Dict[str, Any]],
+                      chunk_size: int = BULK_CHUNK_SIZE,
+                      concurrency: int = BULK_CONCURRENCY) -> BulkWriteSummary:
+    """
+    Inserts documents in concurrent unordered chunks. Returns the aggregated counts.
+    """
+    if not documents:
+        return BulkWriteSummary()
+    chunks = await _chunk(collection, documents, chunk_size)
+    operations = [[InsertOne(document) for document in chunk] for chunk in chunks]
+    return await _run_chunks(collection, operations, concurrency)
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from db.repositories import (
+    BaseRepository,
+    PriceRepository,
+    SocialRepository,
+    InvestorRepository,
+    MarketRepository,
+)
+
+logger = logging.getLogger(__name__)
+
+# Fields that change on every fetch without the entity itself changing
+VOLATILE_FIELDS = {"_id", "timestamp", "date", "fetched_at", "content_hash", "sources"}
+# Most recently written keys remembered per collection; older keys are simply rewritten
+CHANGE_DETECTION_MAX_KEYS = int(os.getenv("CHANGE_DETECTION_MAX_KEYS", "200000"))
+# The seed only reads entities written this recently; older ones are rewritten once
+CHANGE_DETECTION_SEED_HOURS = float(os.getenv("CHANGE_DETECTION_SEED_HOURS", "24"))
+# Price ticks read by the seed; a coin whose price hasn't changed for longer is written once more
+CHANGE_DETECTION_PRICE_SEED_MINUTES = float(
+    os.getenv("CHANGE_DETECTION_PRICE_SEED_MINUTES", "60"))
+
+
+def content_hash(document: Dict[str, Any]) -> str:
+    """
+    Returns a stable hash of a document's non-volatile fields.
+    """
+    payload = {key: value for key, value in document.items()
+               if key not in VOLATILE_FIELDS}
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class ChangeDetector:
+    """
+    Remembers the content hash last written for each entity so ingestion can skip
+    documents that haven't changed since the previous tick.
+    """
+
+    def __init__(self, max_keys: int = CHANGE_DETECTION_MAX_KEYS):
+        self.max_keys = max_keys
+        self._hashes: Dict[str, "OrderedDict[Any, str]"] = {}
+        self.counters: Dict[str, Dict[str, Any]] = {}
+
+    def _remember(self, collection_name: str, key: Any, digest: str) -> None:
+        hashes = self._hashes.setdefault(collection_name, OrderedDict())
+        hashes[key] = digest
+        hashes.move_to_end(key)
+        if len(hashes) > self.max_keys:
+            hashes.popitem(last=False)
+
+    def filter_changed(self, repository: BaseRepository, key_field: str,
+                       documents: List[Dict[str, Any]],
+                       store_hash: bool = True) -> List[Dict[str, Any]]:
+        """
+        Returns only the documents whose content differs from the last written
+        version and records per-tick skipped/written counts. With store_hash the
+        hash is added to each document so it can be seeded back after a restart.
+        """
+        name = repository.collection_name
+        hashes = self._hashes.get(name, {})
+        changed = []
+        for document in documents:
+            digest = content_hash(document)
+            key = document[key_field]
+            if hashes.get(key) == digest:
+                continue
+            if store_hash:
+                document["content_hash"] = digest
+            self._remember(name, key, digest)
+            changed.append(document)
+
+        skipped = len(documents) - len(changed)
+        counters = self.counters.setdefault(
+            name, {"last_written": 0, "last_skipped": 0, "total_written": 0, "total_skipped": 0})
+        counters["last_written"] += len(changed)
+        counters["last_skipped"] += skipped
+        counters["total_written"] += len(changed)
+        counters["total_skipped"] += skipped
+        if skipped:
+            logger.info(f"Skipped {skipped} unchanged documents for '{name}', "
+                        f"writing {len(changed)}.")
+        return changed
+
+    def start_tick(self) -> None:
+        """
+        Resets the per-tick counters; a tick may filter a collection in several chunks.
+        """
+        for counters in self.counters.values():
+            counters.update(last_written=0, last_skipped=0)
+
+    def forget(self, collection_name: str) -> None:
+        """
+        Drops every remembered hash of a collection, e.g. after a failed write.
+        """
+        self._hashes.pop(collection_name, None)
+
+    async def seed(self, db: Optional[AsyncIOMotorDatabase] = None) -> None:
+        """
+        Loads the hashes of what was recently stored, so the first tick after a
+        restart doesn't rewrite everything. Only recent writes are read, through
+        the fetch time indexes, so this stays cheap on a long history.
+        """
+        now = datetime.now(timezone.utc)
+        since = now - timedelta(hours=CHANGE_DETECTION_SEED_HOURS)
+        for repository in (SocialRepository(db), InvestorRepository(db), MarketRepository(db)):
+            key = repository.upsert_key
+            documents = await repository.seed_cursor(since, limit=self.max_keys).to_list(None)
+            # Oldest first, so the most recently written keys are the last to be evicted
+            for document in reversed(documents):
+                if key in document:
+                    self._remember(repository.collection_name,
+                                   document[key], document["content_hash"])
+
+        # Ticks don't store their hash; hash the latest recent tick of each symbol instead
+        prices = PriceRepository(db)
+        seen = set()
+        cursor = prices.recent_ticks_cursor(
+            now - timedelta(minutes=CHANGE_DETECTION_PRICE_SEED_MINUTES))
+        async for tick in cursor:
+            if tick["symbol"] not in seen:
+                seen.add(tick["symbol"])
+                self._remember(prices.collection_name, tick["symbol"], content_hash(tick))
+
+        logger.info("Change detector seeded: " + ", ".join(
+            f"{name}={len(hashes)}" for name, hashes in self._hashes.items()))
+
+
+# Shared by every ingestion job; seeded in tasks.scheduler.start_scheduler()
+change_detector = ChangeDetector()
@@ -1,41 +1,113 @@
 import certifi
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 import os
 from dotenv import load_dotenv
+from pymongo import read_preferences
+from typing import Optional
 import asyncio
+from db.monitoring import command_stats, pool_stats
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Print where certifi's CA certificates are located (for debugging purposes)
-print("Certifi CA file location:", certifi.where())
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "auth_roles")
 
+# Connection pool settings for the shared client
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(
+    os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
 
-async def get_database():
+# Read preference modes accepted in *_READ_PREFERENCE settings
+READ_PREFERENCE_MODES = {
+    "primary": read_preferences.Primary,
+    "primaryPreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondaryPreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+# Process-wide client, created once by init_client()
+_client: Optional[AsyncIOMotorClient] = None
+
+
+def init_client() -> AsyncIOMotorClient:
     """
-    Returns an AsyncIOMotorClient to interact with the MongoDB database.
+    Creates the shared AsyncIOMotorClient. Calling it again returns the existing client.
     """
-    mongo_uri = os.getenv("MONGO_URI")
-    if not mongo_uri:
+    global _client
+    if _client is not None:
+        return _client
+
+    if not MONGO_URI:
         raise ValueError("MongoDB URI is not set in the environment variables")
 
-    # Initialize the MongoDB client with TLS/SSL
-    client = AsyncIOMotorClient(
-        mongo_uri,
+    # Initialize the MongoDB client with TLS/SSL and a bounded connection pool
+    _client = AsyncIOMotorClient(
+        MONGO_URI,
         tls=True,  # Enable TLS/SSL
-        tlsCAFile=certifi.where()  # Use certifi's CA certificates
+        tlsCAFile=certifi.where(),  # Use certifi's CA certificates
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        event_listeners=[pool_stats, command_stats],
     )
+    return _client
+
+
+def get_client() -> AsyncIOMotorClient:
+    """
+    Returns the shared client, creating it lazily for standalone scripts.
+    """
+    if _client is None:
+        return init_client()
+    return _client
+
+
+def close_client() -> None:
+    """
+    Closes the shared client and its connection pool.
+    """
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def get_database(read_preference: Optional[read_preferences._ServerMode] = None) -> AsyncIOMotorDatabase:
+    """
+    Returns the application database from the shared client. Reads follow
+    `read_preference` when given, otherwise the client default (primary).
+    """
+    return get_client().get_database(MONGO_DB_NAME, read_preference=read_preference)
+
+
+def read_preference_from_env(prefix: str, default_mode: str = "primary",
+                             default_max_staleness: int = -1) -> read_preferences._ServerMode:
+    """
+    Builds a read preference from <prefix>_READ_PREFERENCE and
+    <prefix>_MAX_STALENESS_SECONDS. MongoDB requires a max staleness of at
+    least 90 seconds; -1 means no limit.
+    """
+    mode = os.getenv(f"{prefix}_READ_PREFERENCE", default_mode)
+    max_staleness = int(
+        os.getenv(f"{prefix}_MAX_STALENESS_SECONDS", str(default_max_staleness)))
 
-    # Specify the actual database name
-    db = client["auth_roles"]  # Replace with your actual database name
-    return db
+    if mode not in READ_PREFERENCE_MODES:
+        raise ValueError(f"Unknown read preference for {prefix}: {mode}")
+    if mode == "primary":
+        return read_preferences.Primary()
+    return READ_PREFERENCE_MODES[mode](max_staleness=max_staleness)
 
 
 async def verify_connection():
     """
     Verifies the connection to MongoDB by attempting to fetch a simple document.
     """
-    db = await get_database()  # Await for the database connection asynchronously
+    db = get_database()
     try:
         # Try to fetch a document from the 'social_trends' collection (or any other collection)
         sample_doc = await db.social_trends.find_one()
@@ -45,6 +117,8 @@ async def verify_connection():
             print("MongoDB connection successful!")
     except Exception as e:
         print("Failed to connect to MongoDB:", e)
+    finally:
+        close_client()
 
 
 # Test the connection by running the verification function
@@ -0,0 +1,224 @@
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorCursor, AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from db.database import get_database, close_client
+from db.repositories import (
+    PriceRepository,
+    SocialRepository,
+    InvestorRepository,
+    JobRunRepository,
+    LeaseRepository,
+    MarketRepository,
+)
+
+logger = logging.getLogger(__name__)
+
+# Size limits of the capped job run history
+JOB_RUNS_MAX_BYTES = int(os.getenv("JOB_RUNS_MAX_BYTES", str(64 * 1024 * 1024)))
+JOB_RUNS_MAX_DOCUMENTS = int(os.getenv("JOB_RUNS_MAX_DOCUMENTS", "20000"))
+
+# Options for collections that must exist with a specific type before indexing
+COLLECTION_OPTIONS: Dict[str, Dict[str, Any]] = {
+    PriceRepository.collection_name: {
+        "timeseries": {"timeField": "timestamp", "metaField": "symbol", "granularity": "minutes"},
+    },
+    JobRunRepository.collection_name: {
+        "capped": True, "size": JOB_RUNS_MAX_BYTES, "max": JOB_RUNS_MAX_DOCUMENTS,
+    },
+}
+
+# Index definitions per collection. Compound keys follow equality -> sort -> range
+# so the route queries can use the index for both the filter and the sort.
+INDEXES: Dict[str, List[IndexModel]] = {
+    PriceRepository.collection_name: [
+        IndexModel([("symbol", ASCENDING), ("timestamp", DESCENDING), ("price", ASCENDING)],
+                   name="symbol_timestamp_price"),
+        # The change detector's seed reads the last hour of ticks
+        IndexModel([("timestamp", DESCENDING)], name="timestamp"),
+    ],
+    SocialRepository.collection_name: [
+        IndexModel([("symbol", ASCENDING), ("timestamp", DESCENDING)],
+                   name="symbol_timestamp"),
+        # Documents created through POST /api/social have no upstream id
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True,
+                   partialFilterExpression={"id": {"$exists": True}}),
+        IndexModel([("timestamp", DESCENDING)], name="timestamp"),
+    ],
+    InvestorRepository.collection_name: [
+        IndexModel([("coin_symbol", ASCENDING), ("investor_name", ASCENDING)],
+                   name="coin_symbol_investor_name"),
+        # Documents created through POST /api/investors have no upstream name
+        IndexModel([("name", ASCENDING)], name="name_unique", unique=True,
+                   partialFilterExpression={"name": {"$exists": True}}),
+        IndexModel([("fetched_at", DESCENDING)], name="fetched_at"),
+    ],
+    MarketRepository.collection_name: [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("timestamp", DESCENDING)], name="timestamp"),
+    ],
+    JobRunRepository.collection_name: [
+        IndexModel([("job_id", ASCENDING), ("started_at", DESCENDING)],
+                   name="job_id_started_at"),
+        IndexModel([("started_at", DESCENDING)], name="started_at"),
+    ],
+}
+
+# Indexes created by earlier versions that ensure_indexes() drops
+OBSOLETE_INDEXES: Dict[str, List[str]] = {
+    # A TTL index deleted expired leases, which restarted their term at 1. Leases
+    # are never deleted now: there is one small document per lease name.
+    LeaseRepository.collection_name: ["expires_at_ttl"],
+}
+
+
+async def ensure_collections(db: Optional[AsyncIOMotorDatabase] = None) -> None:
+    """
+    Creates the collections in COLLECTION_OPTIONS that don't exist yet. An existing
+    collection of the wrong type is left alone and reported; see db.migrate_prices.
+    """
+    db = db if db is not None else get_database()
+    existing = {info["name"]: info async for info in await db.list_collections()}
+    for collection_name, options in COLLECTION_OPTIONS.items():
+        info = existing.get(collection_name)
+        if info is None:
+            await db.create_collection(collection_name, **options)
+            logger.info(f"Created collection '{collection_name}' with {options}")
+        elif "timeseries" in options and info.get("type") != "timeseries":
+            logger.warning(
+                f"Collection '{collection_name}' is not a time-series collection; "
+                f"run 'python -m db.migrate_prices' to migrate it.")
+        elif "capped" in options and not info.get("options", {}).get("capped"):
+            logger.warning(
+                f"Collection '{collection_name}' is not capped and will grow without bound; "
+                f"drop it to have it recreated as a capped collection.")
+
+
+async def ensure_indexes(db: Optional[AsyncIOMotorDatabase] = None) -> None:
+    """
+    Creates every index in INDEXES and drops the ones in OBSOLETE_INDEXES. Existing
+    indexes with the same spec are left as-is, so this is safe to run on every startup.
+    """
+    db = db if db is not None else get_database()
+    for collection_name, indexes in INDEXES.items():
+        names = await db[collection_name].create_indexes(indexes)
+        logger.info(f"Indexes ensured on '{collection_name}': {names}")
+
+    for collection_name, names in OBSOLETE_INDEXES.items():
+        existing = await db[collection_name].index_information()
+        for name in names:
+            if name in existing:
+                await db[collection_name].drop_index(name)
+                logger.info(f"Dropped obsolete index '{name}' on '{collection_name}'")
+
+
+def audit_queries(db: AsyncIOMotorDatabase) -> List[Tuple[str, AsyncIOMotorCursor]]:
+    """
+    Returns every query shape issued by the routes and scheduler jobs, built through
+    the same repository methods they use.
+    """
+    prices = PriceRepository(db)
+    social = SocialRepository(db)
+    investors = InvestorRepository(db)
+    markets = MarketRepository(db)
+    job_runs = JobRunRepository(db)
+    now = datetime.now(timezone.utc)
+
+    return [
+        ("GET /api/prices", prices.symbol_cursor("bitcoin", 0, 0.1)),
+        ("GET /api/prices?before", prices.symbol_cursor(
+            "bitcoin", 0, 0.1, before=now)),
+        ("GET /api/social", social.symbol_cursor("BTC")),
+        ("GET /api/social?before", social.symbol_cursor("BTC", before=now)),
+        ("GET /api/investors", investors.coin_cursor("BTC")),
+        ("GET /api/investors?after", investors.coin_cursor("BTC", after="a")),
+        ("fetch_and_store_social_data upsert", social.upsert_key_cursor("abc")),
+        ("store_investor_data upsert", investors.upsert_key_cursor("abc")),
+        ("store_filtered_currencies upsert", markets.upsert_key_cursor("bitcoin")),
+        ("GET /api/jobs", job_runs.recent_cursor()),
+        ("GET /api/jobs?job_id", job_runs.recent_cursor("tick")),
+        ("change_detector.seed social", social.seed_cursor(now)),
+        ("change_detector.seed investors", investors.seed_cursor(now)),
+        ("change_detector.seed markets", markets.seed_cursor(now)),
+        ("change_detector.seed prices", prices.recent_ticks_cursor(now)),
+    ]
+
+
+def find_winning_plans(explain: Any) -> List[Any]:
+    """
+    Collects every winningPlan in an explain() result. Time-series and aggregate
+    explains nest the plan under pipeline stages rather than at the top level.
+    """
+    plans = []
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                plans.append(value)
+            else:
+                plans.extend(find_winning_plans(value))
+    elif isinstance(explain, list):
+        for item in explain:
+            plans.extend(find_winning_plans(item))
+    return plans
+
+
+def find_stages(plan: Any) -> List[str]:
+    """
+    Collects every stage name in an explain() plan tree.
+    """
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(find_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(find_stages(item))
+    return stages
+
+
+async def audit(db: Optional[AsyncIOMotorDatabase] = None) -> bool:
+    """
+    Runs explain() on every audited query shape. Returns False if any plans a COLLSCAN.
+    """
+    db = db if db is not None else get_database()
+    ok = True
+    for name, cursor in audit_queries(db):
+        explain = await cursor.explain()
+        stages = find_stages(find_winning_plans(explain))
+        if "COLLSCAN" in stages:
+            ok = False
+            print(f"COLLSCAN  {name}: {' <- '.join(stages)}")
+        else:
+            print(f"ok        {name}: {' <- '.join(stages)}")
+    return ok
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Apply the declared MongoDB indexes or audit query plans.")
+    parser.add_argument("--audit", action="store_true",
+                        help="explain() every route and job query and fail on COLLSCAN")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.audit:
+            return 0 if await audit() else 1
+        await ensure_collections()
+        await ensure_indexes()
+        return 0
+    finally:
+        close_client()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main()))
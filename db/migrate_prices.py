@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from db.database import get_database, close_client
+from db.indexes import ensure_collections, ensure_indexes
+from db.repositories import PriceRepository
+
+logger = logging.getLogger(__name__)
+
+# The regular 'prices' collection is renamed to this before the time-series one is created
+LEGACY_COLLECTION = "prices_legacy"
+# Progress is checkpointed here so an interrupted run resumes where it stopped
+CHECKPOINT_COLLECTION = "migrations"
+MIGRATION_ID = "prices_timeseries"
+DEFAULT_BATCH_SIZE = 500
+
+
+def explode_legacy_document(document: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Turns one legacy document into tick documents. Blobs written by the old
+    save_prices_to_db look like {"data": {coin_id: {...}}, "timestamp"}; flat
+    {"symbol", "price", "timestamp"} documents are carried over as they are.
+    """
+    timestamp = document.get("timestamp")
+    if timestamp is None:
+        return []
+    if isinstance(document.get("data"), dict):
+        return PriceRepository.ticks_from_snapshot(document["data"], timestamp)
+    if "symbol" in document and "price" in document:
+        return [{"symbol": document["symbol"], "price": document["price"], "timestamp": timestamp}]
+    return []
+
+
+async def prepare_collections(db: AsyncIOMotorDatabase) -> None:
+    """
+    Moves a regular 'prices' collection out of the way and creates the
+    time-series collection and its indexes.
+    """
+    prices_name = PriceRepository.collection_name
+    existing = {info["name"]: info async for info in await db.list_collections()}
+    prices_info = existing.get(prices_name)
+
+    if prices_info is not None and prices_info.get("type") != "timeseries":
+        if LEGACY_COLLECTION in existing:
+            raise RuntimeError(
+                f"Both '{prices_name}' and '{LEGACY_COLLECTION}' exist as regular collections; "
+                f"resolve this manually before migrating.")
+        await db[prices_name].rename(LEGACY_COLLECTION)
+        logger.info(f"Renamed '{prices_name}' to '{LEGACY_COLLECTION}'")
+
+    await ensure_collections(db)
+    await ensure_indexes(db)
+
+
+async def discard_pending_batch(db: AsyncIOMotorDatabase, checkpoint: Dict[str, Any]) -> None:
+    """
+    Removes ticks from a batch that was inserted but not checkpointed before the
+    previous run stopped. Legacy timestamps are unique per fetch, so they identify
+    the batch. Deleting on the timeField of a time-series collection needs MongoDB 7.0+.
+    """
+    query: Dict[str, Any] = {"_id": {"$lte": checkpoint["pending_last_id"]}}
+    if checkpoint.get("last_id") is not None:
+        query["_id"]["$gt"] = checkpoint["last_id"]
+
+    timestamps = await db[LEGACY_COLLECTION].distinct("timestamp", query)
+    if timestamps:
+        result = await db[PriceRepository.collection_name].delete_many(
+            {"timestamp": {"$in": timestamps}})
+        logger.info(
+            f"Discarded {result.deleted_count} ticks from an unfinished batch.")
+
+
+async def migrate(db: Optional[AsyncIOMotorDatabase] = None,
+                  batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Explodes every legacy price document into per-symbol ticks, batch by batch.
+    Safe to interrupt and re-run: it resumes after the last checkpointed batch.
+    """
+    db = db if db is not None else get_database()
+    await prepare_collections(db)
+
+    checkpoints = db[CHECKPOINT_COLLECTION]
+    legacy = db[LEGACY_COLLECTION]
+    prices = PriceRepository(db)
+
+    checkpoint = await checkpoints.find_one({"_id": MIGRATION_ID}) or {}
+    if checkpoint.get("pending_last_id") is not None:
+        await discard_pending_batch(db, checkpoint)
+    last_id = checkpoint.get("last_id")
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await legacy.find(query).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+
+        batch_last_id = batch[-1]["_id"]
+        # Mark the batch as in flight before writing so a crash can be cleaned up
+        await checkpoints.update_one({"_id": MIGRATION_ID},
+                                     {"$set": {"pending_last_id": batch_last_id}}, upsert=True)
+
+        ticks = [tick for document in batch for tick in explode_legacy_document(document)]
+        summary = await prices.insert_many(ticks)
+        if summary.error_count:
+            # Leave the batch pending so the next run discards and retries it
+            raise RuntimeError(
+                f"{summary.error_count} ticks failed to insert in the batch ending at {batch_last_id}")
+        inserted = summary.inserted_count
+
+        await checkpoints.update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {"last_id": batch_last_id, "updated_at": datetime.now(timezone.utc)},
+             "$unset": {"pending_last_id": ""},
+             "$inc": {"documents_read": len(batch), "ticks_written": inserted}})
+        last_id = batch_last_id
+        logger.info(f"Migrated {len(batch)} documents into {inserted} ticks (up to {last_id}).")
+
+    await checkpoints.update_one({"_id": MIGRATION_ID},
+                                 {"$set": {"completed_at": datetime.now(timezone.utc)}}, upsert=True)
+    return await checkpoints.find_one({"_id": MIGRATION_ID})
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Migrate price blobs into the 'prices' time-series collection.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="legacy documents read per batch")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = await migrate(batch_size=args.batch_size)
+        print(f"Migration finished: {summary}")
+        return 0
+    finally:
+        close_client()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,355 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# How often the background sampler pings MongoDB
+HEALTH_PING_INTERVAL_SECONDS = float(
+    os.getenv("HEALTH_PING_INTERVAL_SECONDS", "5"))
+# Number of recent checkout waits kept per pool for percentiles
+POOL_WAIT_SAMPLES = 1000
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    Returns the nearest-rank percentile of values, or None when empty.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Tracks open/in-use connections and checkout wait times per server.
+    Motor runs pymongo in worker threads, so every update takes the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools: Dict[str, Dict[str, Any]] = {}
+
+    def _pool(self, address) -> Dict[str, Any]:
+        key = f"{address[0]}:{address[1]}"
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = {"open": 0, "in_use": 0, "checkout_failures": 0,
+                    "waits": deque(maxlen=POOL_WAIT_SAMPLES)}
+            self._pools[key] = pool
+        return pool
+
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._pools.pop(f"{event.address[0]}:{event.address[1]}", None)
+
+    def connection_created(self, event):
+        with self._lock:
+            self._pool(event.address)["open"] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["open"] = max(0, pool["open"] - 1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self._pool(event.address)["checkout_failures"] += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["in_use"] += 1
+            if event.duration is not None:
+                pool["waits"].append(event.duration * 1000)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["in_use"] = max(0, pool["in_use"] - 1)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns connection counts and checkout wait percentiles (ms) per server.
+        """
+        with self._lock:
+            pools = {key: (dict(pool), list(pool["waits"]))
+                     for key, pool in self._pools.items()}
+
+        result = {}
+        for key, (pool, waits) in pools.items():
+            result[key] = {
+                "open": pool["open"],
+                "in_use": pool["in_use"],
+                "available": max(0, pool["open"] - pool["in_use"]),
+                "checkout_failures": pool["checkout_failures"],
+                "checkout_wait_ms": {
+                    "p50": percentile(waits, 50),
+                    "p95": percentile(waits, 95),
+                    "max": max(waits) if waits else None,
+                },
+            }
+        return result
+
+
+# Registered on the shared client in db.database.init_client()
+pool_stats = PoolStatsListener()
+
+# Latest ping sample, refreshed by the background sampler
+ping_sample: Dict[str, Any] = {
+    "ok": False, "rtt_ms": None, "sampled_at": None, "error": None}
+
+_sampler_task: Optional[asyncio.Task] = None
+
+
+async def sample_ping(db: AsyncIOMotorDatabase) -> Dict[str, Any]:
+    """
+    Pings MongoDB once and stores the round-trip time in ping_sample.
+    """
+    started = time.perf_counter()
+    try:
+        await db.command("ping")
+        ping_sample.update(ok=True, error=None,
+                           rtt_ms=(time.perf_counter() - started) * 1000)
+    except Exception as e:
+        ping_sample.update(ok=False, rtt_ms=None, error=str(e))
+    ping_sample["sampled_at"] = datetime.now(timezone.utc)
+    return ping_sample
+
+
+async def _sample_forever(db: AsyncIOMotorDatabase, interval: float):
+    while True:
+        await sample_ping(db)
+        await asyncio.sleep(interval)
+
+
+def start_health_sampler(db: AsyncIOMotorDatabase,
+                         interval: float = HEALTH_PING_INTERVAL_SECONDS) -> None:
+    """
+    Starts the background ping sampler on the running event loop.
+    """
+    global _sampler_task
+    if _sampler_task is None or _sampler_task.done():
+        _sampler_task = asyncio.create_task(_sample_forever(db, interval))
+
+
+async def stop_health_sampler() -> None:
+    """
+    Cancels the background ping sampler.
+    """
+    global _sampler_task
+    if _sampler_task is not None:
+        _sampler_task.cancel()
+        try:
+            await _sampler_task
+        except asyncio.CancelledError:
+            pass
+        _sampler_task = None
+
+
+# Name of the route or scheduler job issuing the current MongoDB commands.
+# Motor copies the context into its worker threads, so listeners can read it.
+query_source: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "query_source", default="unknown")
+
+# Latency histogram bucket upper bounds in milliseconds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Maximum number of distinct query shapes kept before the rarest is evicted
+MAX_QUERY_SHAPES = int(os.getenv("MONGO_MAX_QUERY_SHAPES", "500"))
+
+# Commands whose filter lives under a different key than "filter"
+FILTER_KEYS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+}
+# Commands that carry a list of statements, each with its own filter under "q"
+STATEMENT_KEYS = {"update": "updates", "delete": "deletes"}
+# Handshake and session commands that say nothing about query load
+IGNORED_COMMANDS = {"hello", "isMaster", "ismaster", "ping", "saslStart",
+                    "saslContinue", "endSessions", "buildInfo", "getMore", "killCursors"}
+
+
+@contextlib.contextmanager
+def tag_queries(source: str):
+    """
+    Attributes MongoDB commands issued inside the block to `source`.
+    """
+    token = query_source.set(source)
+    try:
+        yield
+    finally:
+        query_source.reset(token)
+
+
+def normalize_shape(value: Any) -> Any:
+    """
+    Replaces literal values in a filter with "?" while keeping field names and
+    operators, e.g. {"symbol": "btc", "price": {"$gte": 1}} -> {symbol: ?, price: {$gte: ?}}.
+    """
+    if isinstance(value, dict):
+        return {key: normalize_shape(item) if key.startswith("$") or isinstance(item, dict)
+                else "?" for key, item in value.items()}
+    if isinstance(value, list):
+        # $and/$or/$nor hold sub-filters; $in/$nin hold literals
+        if value and all(isinstance(item, dict) for item in value):
+            return [normalize_shape(item) for item in value]
+        return "?"
+    return "?"
+
+
+def format_shape(shape: Any) -> str:
+    """
+    Renders a normalized shape without quotes, e.g. {symbol: ?, price: {$gte: ?}}.
+    """
+    if isinstance(shape, dict):
+        return "{" + ", ".join(f"{key}: {format_shape(item)}" for key, item in shape.items()) + "}"
+    if isinstance(shape, list):
+        return "[" + ", ".join(format_shape(item) for item in shape) + "]"
+    return str(shape)
+
+
+def command_shape(command_name: str, command: Dict[str, Any]) -> Optional[str]:
+    """
+    Extracts the collection and normalized filter shape from a command document.
+    """
+    collection = command.get(command_name)
+    if not isinstance(collection, str):
+        return None
+
+    if command_name in FILTER_KEYS:
+        filter_shape = format_shape(normalize_shape(
+            command.get(FILTER_KEYS[command_name]) or {}))
+    elif command_name in STATEMENT_KEYS:
+        statements = command.get(STATEMENT_KEYS[command_name]) or [{}]
+        filter_shape = format_shape(normalize_shape(statements[0].get("q") or {}))
+    elif command_name == "aggregate":
+        pipeline = command.get("pipeline") or []
+        match = pipeline[0].get("$match", {}) if pipeline else {}
+        filter_shape = format_shape(normalize_shape(match))
+    else:
+        filter_shape = "-"
+
+    sort = command.get("sort")
+    sort_shape = f" sort {format_shape(dict(sort))}" if sort else ""
+    return f"{collection}.{command_name} {filter_shape}{sort_shape}"
+
+
+class CommandStatsListener(monitoring.CommandListener):
+    """
+    Records per-command latency histograms and a table of normalized query shapes
+    with their count, total and max latency, attributed to the issuing route or job.
+    """
+
+    def __init__(self, max_shapes: int = MAX_QUERY_SHAPES):
+        self._lock = threading.Lock()
+        self._max_shapes = max_shapes
+        self._pending: Dict[Any, Any] = {}
+        self._histograms: Dict[str, List[int]] = {}
+        self._shapes: Dict[Any, Dict[str, Any]] = {}
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        shape = command_shape(event.command_name, event.command)
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (
+                shape, query_source.get())
+
+    def succeeded(self, event):
+        self._record(event, failed=False)
+
+    def failed(self, event):
+        self._record(event, failed=True)
+
+    def _record(self, event, failed: bool):
+        duration_ms = event.duration_micros / 1000
+        with self._lock:
+            pending = self._pending.pop(
+                (event.connection_id, event.request_id), None)
+            if pending is None:
+                return
+            shape, source = pending
+
+            histogram = self._histograms.setdefault(
+                event.command_name, [0] * (len(LATENCY_BUCKETS_MS) + 1))
+            histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, duration_ms)] += 1
+
+            if shape is None:
+                return
+            key = (shape, source)
+            stats = self._shapes.get(key)
+            if stats is None:
+                if len(self._shapes) >= self._max_shapes:
+                    rarest = min(self._shapes, key=lambda k: self._shapes[k]["count"])
+                    del self._shapes[rarest]
+                stats = {"shape": shape, "source": source, "count": 0,
+                         "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+                self._shapes[key] = stats
+            stats["count"] += 1
+            stats["total_ms"] += duration_ms
+            stats["max_ms"] = max(stats["max_ms"], duration_ms)
+            if failed:
+                stats["errors"] += 1
+
+    def histograms(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns the latency histogram of each command as {"<=N ms": count}.
+        """
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + \
+            [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        with self._lock:
+            return {name: dict(zip(labels, counts))
+                    for name, counts in self._histograms.items()}
+
+    def top_shapes(self, limit: int = 20) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Returns the slowest (by max and total latency) and most frequent query shapes.
+        """
+        with self._lock:
+            shapes = [dict(stats, avg_ms=stats["total_ms"] / stats["count"])
+                      for stats in self._shapes.values()]
+        return {
+            "slowest": sorted(shapes, key=lambda s: s["max_ms"], reverse=True)[:limit],
+            "most_time": sorted(shapes, key=lambda s: s["total_ms"], reverse=True)[:limit],
+            "most_frequent": sorted(shapes, key=lambda s: s["count"], reverse=True)[:limit],
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._shapes.clear()
+
+
+# Registered on the shared client in db.database.init_client()
+command_stats = CommandStatsListener()
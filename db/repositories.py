@@ -0,0 +1,318 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCursor, AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from pymongo.read_preferences import _ServerMode
+from pymongo.results import BulkWriteResult
+
+from db.bulk import BulkWriteSummary, bulk_insert, bulk_upsert
+from db.database import get_database
+
+
+class BaseRepository:
+    """
+    Shared write helpers for a single collection. Subclasses set collection_name
+    and define the query shapes used by the routes and scheduler jobs.
+    """
+    collection_name: str = ""
+    upsert_key: str = "_id"
+    # Set to the fetch time on every write; bounds the change detector's seed
+    updated_field: str = "timestamp"
+
+    def __init__(self, db: Optional[AsyncIOMotorDatabase] = None,
+                 read_preference: Optional[_ServerMode] = None):
+        self.db = db if db is not None else get_database()
+        # Writes always go to the primary; read_preference only routes reads
+        self.collection = self.db.get_collection(
+            self.collection_name, read_preference=read_preference)
+
+    async def insert_one(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Inserts a document and returns it with its new _id.
+        """
+        result = await self.collection.insert_one(document)
+        document["_id"] = result.inserted_id
+        return document
+
+    async def insert_many(self, documents: List[Dict[str, Any]]) -> BulkWriteSummary:
+        """
+        Inserts documents in concurrent unordered chunks so one bad document
+        doesn't stop the batch.
+        """
+        return await bulk_insert(self.collection, documents)
+
+    async def bulk_write(self, operations: List[Any]) -> Optional[BulkWriteResult]:
+        """
+        Runs an unordered bulk write.
+        """
+        if not operations:
+            return None
+        return await self.collection.bulk_write(operations, ordered=False)
+
+    async def upsert_many(self, documents: List[Dict[str, Any]]) -> BulkWriteSummary:
+        """
+        Upserts documents keyed on upsert_key in concurrent unordered chunks.
+        """
+        return await bulk_upsert(self.collection, documents, self.upsert_key)
+
+    def upsert_key_cursor(self, value: Any) -> AsyncIOMotorCursor:
+        """
+        Builds a lookup on upsert_key, the filter every upsert runs.
+        """
+        return self.collection.find({self.upsert_key: value})
+
+    def seed_cursor(self, since: datetime, limit: int = 0) -> AsyncIOMotorCursor:
+        """
+        Builds the cursor behind ChangeDetector.seed(): the key and content hash of
+        every entity written since `since`, newest first.
+        """
+        return self.collection.find(
+            {self.updated_field: {"$gte": since}, "content_hash": {"$exists": True}},
+            {"_id": 0, self.upsert_key: 1, "content_hash": 1},
+        ).sort(self.updated_field, -1).limit(limit)
+
+
+class PriceRepository(BaseRepository):
+    # Time-series collection: "symbol" is the metaField, "timestamp" the timeField
+    collection_name = "prices"
+    projection = {"_id": 0, "symbol": 1, "price": 1, "timestamp": 1}
+
+    def symbol_cursor(
+        self,
+        symbol: str,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        before: Optional[datetime] = None,
+        limit: int = 100,
+    ) -> AsyncIOMotorCursor:
+        """
+        Builds the cursor behind find_by_symbol.
+        """
+        query: Dict[str, Any] = {"symbol": symbol}
+        price_range = {}
+        if min_price is not None:
+            price_range["$gte"] = min_price
+        if max_price is not None:
+            price_range["$lte"] = max_price
+        if price_range:
+            query["price"] = price_range
+        if before is not None:
+            query["timestamp"] = {"$lt": before}
+
+        return self.collection.find(query, self.projection).sort(
+            "timestamp", -1).limit(limit)
+
+    def recent_ticks_cursor(self, since: datetime) -> AsyncIOMotorCursor:
+        """
+        Builds the cursor behind ChangeDetector.seed(): every tick since `since`,
+        newest first.
+        """
+        return self.collection.find({"timestamp": {"$gte": since}}, {"_id": 0}).sort(
+            "timestamp", -1)
+
+    async def find_by_symbol(
+        self,
+        symbol: str,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        before: Optional[datetime] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns the newest prices for a symbol, optionally within a price range.
+        Pass the last timestamp of a page as `before` to get the next page.
+        """
+        cursor = self.symbol_cursor(symbol, min_price, max_price, before, limit)
+        return await cursor.to_list(length=limit)
+
+    @staticmethod
+    def ticks_from_snapshot(data: Dict[str, Any], timestamp: datetime) -> List[Dict[str, Any]]:
+        """
+        Explodes a /simple/price response ({coin_id: {"usd": ..., ...}}) into one
+        tick document per symbol. Consensus prices also record their sources.
+        """
+        return [
+            {
+                "symbol": coin_id,
+                "timestamp": timestamp,
+                "price": coin_data["usd"],
+                "market_cap": coin_data.get("usd_market_cap"),
+                "volume_24h": coin_data.get("usd_24h_vol"),
+                "sources": coin_data.get("sources"),
+            }
+            for coin_id, coin_data in data.items()
+            if "usd" in coin_data
+        ]
+
+    async def insert_ticks(self, data: Dict[str, Any],
+                           timestamp: Optional[datetime] = None) -> BulkWriteSummary:
+        """
+        Stores one fetch of price data as one tick document per symbol.
+        """
+        timestamp = timestamp or datetime.now(timezone.utc)
+        return await self.insert_many(self.ticks_from_snapshot(data, timestamp))
+
+
+class SocialRepository(BaseRepository):
+    collection_name = "social_trends"
+    upsert_key = "id"
+    projection = {
+        "_id": 0, "symbol": 1, "platform": 1, "followers": 1, "engagement": 1,
+        "timestamp": 1, "trend": 1, "mentions": 1, "positive_sentiment": 1, "date": 1,
+    }
+
+    def symbol_cursor(
+        self,
+        symbol: str,
+        before: Optional[datetime] = None,
+        limit: int = 100,
+    ) -> AsyncIOMotorCursor:
+        """
+        Builds the cursor behind find_by_symbol.
+        """
+        query: Dict[str, Any] = {"symbol": symbol}
+        if before is not None:
+            query["timestamp"] = {"$lt": before}
+
+        return self.collection.find(query, self.projection).sort(
+            "timestamp", -1).limit(limit)
+
+    async def find_by_symbol(
+        self,
+        symbol: str,
+        before: Optional[datetime] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns the newest social trends for a symbol, paged by `before`.
+        """
+        cursor = self.symbol_cursor(symbol, before, limit)
+        return await cursor.to_list(length=limit)
+
+    async def upsert_posts(self, posts: List[Dict[str, Any]]) -> BulkWriteSummary:
+        """
+        Upserts social posts keyed on their upstream post id.
+        """
+        return await self.upsert_many(posts)
+
+
+class InvestorRepository(BaseRepository):
+    collection_name = "investors"
+    upsert_key = "name"
+    updated_field = "fetched_at"
+    projection = {
+        "_id": 0, "coin_symbol": 1, "investor_name": 1, "investment_amount": 1,
+        "investment_type": 1, "investment_date": 1,
+    }
+
+    def coin_cursor(
+        self,
+        coin_symbol: str,
+        after: Optional[str] = None,
+        limit: int = 100,
+    ) -> AsyncIOMotorCursor:
+        """
+        Builds the cursor behind find_by_coin.
+        """
+        query: Dict[str, Any] = {"coin_symbol": coin_symbol}
+        if after is not None:
+            query["investor_name"] = {"$gt": after}
+
+        return self.collection.find(query, self.projection).sort(
+            "investor_name", 1).limit(limit)
+
+    async def find_by_coin(
+        self,
+        coin_symbol: str,
+        after: Optional[str] = None,
+        limit: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns investors for a coin ordered by name, paged by `after`.
+        """
+        cursor = self.coin_cursor(coin_symbol, after, limit)
+        return await cursor.to_list(length=limit)
+
+    async def upsert_investors(self, investors: List[Dict[str, Any]]) -> BulkWriteSummary:
+        """
+        Upserts fetched investors keyed on their name.
+        """
+        return await self.upsert_many(investors)
+
+
+class MarketRepository(BaseRepository):
+    collection_name = "market_snapshots"
+    upsert_key = "id"
+
+    async def upsert_currencies(self, currencies: List[Dict[str, Any]]) -> BulkWriteSummary:
+        """
+        Upserts the latest market snapshot of each coin keyed on its CoinGecko id.
+        """
+        return await self.upsert_many(currencies)
+
+
+class LeaseRepository(BaseRepository):
+    # One document per lease: {_id: name, holder, term, acquired_at, renewed_at, expires_at}
+    collection_name = "leases"
+
+    async def try_acquire(self, name: str, holder: str, ttl_seconds: float) -> Optional[Dict[str, Any]]:
+        """
+        Takes or renews the lease for ttl_seconds if it is free, expired or already
+        held by `holder`. Returns the lease, or None while someone else holds it.
+        Expiry uses the server's clock ($$NOW), so clock skew between nodes doesn't
+        matter. The term goes up each time the lease changes hands.
+        """
+        same_holder = {"$eq": ["$holder", holder]}
+        try:
+            return await self.collection.find_one_and_update(
+                {"_id": name, "$or": [{"holder": holder},
+                                      {"$expr": {"$lt": ["$expires_at", "$$NOW"]}}]},
+                [{"$set": {
+                    "holder": holder,
+                    "term": {"$cond": [same_holder, "$term",
+                                       {"$add": [{"$ifNull": ["$term", 0]}, 1]}]},
+                    "acquired_at": {"$cond": [same_holder, "$acquired_at", "$$NOW"]},
+                    "renewed_at": "$$NOW",
+                    "expires_at": {"$add": ["$$NOW", int(ttl_seconds * 1000)]},
+                }}],
+                upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # The lease exists and is held by someone else, so the upsert collided
+            return None
+
+    async def release(self, name: str, holder: str) -> bool:
+        """
+        Gives the lease up if `holder` still has it, so another process can take it at once.
+        The document is expired rather than deleted, so the term keeps counting up.
+        """
+        result = await self.collection.update_one(
+            {"_id": name, "holder": holder}, [{"$set": {"expires_at": "$$NOW"}}])
+        return result.modified_count == 1
+
+    async def current(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the lease document, expired or not.
+        """
+        return await self.collection.find_one({"_id": name})
+
+
+class JobRunRepository(BaseRepository):
+    # Capped collection: the oldest runs are dropped once it is full
+    collection_name = "job_runs"
+    projection = {"_id": 0}
+
+    def recent_cursor(self, job_id: Optional[str] = None, limit: int = 100) -> AsyncIOMotorCursor:
+        """
+        Builds the cursor behind find_recent.
+        """
+        query: Dict[str, Any] = {"job_id": job_id} if job_id is not None else {}
+        return self.collection.find(query, self.projection).sort(
+            "started_at", -1).limit(limit)
+
+    async def find_recent(self, job_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Returns the most recent runs, newest first, of one job or of all jobs.
+        """
+        return await self.recent_cursor(job_id, limit).to_list(length=limit)
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+from db.bulk import BulkWriteSummary
+from db.change_detection import change_detector
+from db.repositories import BaseRepository
+
+logger = logging.getLogger(__name__)
+
+# Flush a collection once this many operations are queued for it
+WRITE_BUFFER_MAX_BATCH = int(os.getenv("WRITE_BUFFER_MAX_BATCH", "1000"))
+# Flush everything at least this often, even if no batch is full
+WRITE_BUFFER_MAX_LATENCY_SECONDS = float(
+    os.getenv("WRITE_BUFFER_MAX_LATENCY_SECONDS", "2"))
+# Producers wait once this many operations are queued in total
+WRITE_BUFFER_MAX_PENDING = int(os.getenv("WRITE_BUFFER_MAX_PENDING", "20000"))
+
+
+class WriteBehindBuffer:
+    """
+    Collects ingestion writes in memory and sends them through the chunked bulk
+    insert/upsert helpers when a batch fills up or the latency budget runs out.
+    Upserts to the same key before a flush collapse into the last one.
+    """
+
+    def __init__(self, max_batch: int = WRITE_BUFFER_MAX_BATCH,
+                 max_latency: float = WRITE_BUFFER_MAX_LATENCY_SECONDS,
+                 max_pending: int = WRITE_BUFFER_MAX_PENDING):
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.max_pending = max_pending
+
+        self._repositories: Dict[str, BaseRepository] = {}
+        self._inserts: Dict[str, List[Dict[str, Any]]] = {}
+        self._upserts: Dict[str, Dict[Tuple[str, Any], Dict[str, Any]]] = {}
+        self._pending = 0
+        self._space = asyncio.Condition()
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self.stats = {"queued": 0, "coalesced": 0, "backpressure_waits": 0, "flushes": 0}
+        self.written = BulkWriteSummary()
+        # Operations that failed to write, per collection
+        self.failed: Dict[str, int] = {}
+
+    async def add_inserts(self, repository: BaseRepository, documents: List[Dict[str, Any]]) -> None:
+        """
+        Queues documents to be inserted into the repository's collection.
+        """
+        if not documents:
+            return
+        await self._reserve(len(documents))
+        name = repository.collection_name
+        self._repositories.setdefault(name, repository)
+        self._inserts.setdefault(name, []).extend(documents)
+        self.stats["queued"] += len(documents)
+        self._after_enqueue(name)
+
+    async def add_upserts(self, repository: BaseRepository, documents: List[Dict[str, Any]]) -> None:
+        """
+        Queues upserts keyed on the repository's upsert_key.
+        """
+        if not documents:
+            return
+        await self._reserve(len(documents))
+        name = repository.collection_name
+        self._repositories.setdefault(name, repository)
+        upserts = self._upserts.setdefault(name, {})
+        for document in documents:
+            key = (repository.upsert_key, document[repository.upsert_key])
+            if key in upserts:
+                # Replaces a queued write, so it frees the slot reserved for it
+                self.stats["coalesced"] += 1
+                self._pending -= 1
+            upserts[key] = document
+        self.stats["queued"] += len(documents)
+        self._after_enqueue(name)
+
+    async def _reserve(self, count: int) -> None:
+        """
+        Waits until there is room for `count` more operations. An empty buffer
+        always accepts, so one oversized batch cannot block forever.
+        """
+        async with self._space:
+            if self._pending and self._pending + count > self.max_pending:
+                self.stats["backpressure_waits"] += 1
+                self._wake.set()
+                await self._space.wait_for(
+                    lambda: not self._pending or self._pending + count <= self.max_pending)
+            self._pending += count
+
+    def _after_enqueue(self, name: str) -> None:
+        self._ensure_flusher()
+        queued = len(self._inserts.get(name, ())) + len(self._upserts.get(name, ()))
+        if queued >= self.max_batch:
+            self._wake.set()
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_forever())
+
+    async def _flush_forever(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.max_latency)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def _write(self, name: str, write: Awaitable[BulkWriteSummary], count: int) -> None:
+        """
+        Awaits one collection's write. A write that fails outright counts all its
+        operations as errors instead of taking the flusher down with it.
+        """
+        try:
+            summary = await write
+        except Exception:
+            logger.exception(f"Flushing {count} writes to '{name}' failed")
+            summary = BulkWriteSummary()
+            summary.error_count = count
+        self.written.merge(summary)
+        if summary.error_count:
+            self.failed[name] = self.failed.get(name, 0) + summary.error_count
+            # Some remembered hashes were never stored; rewrite next tick
+            change_detector.forget(name)
+
+    async def flush(self) -> None:
+        """
+        Writes everything queued so far, all collections concurrently.
+        """
+        async with self._flush_lock:
+            inserts, self._inserts = self._inserts, {}
+            upserts, self._upserts = self._upserts, {}
+            try:
+                writes = [self._write(name, self._repositories[name].insert_many(documents),
+                                      len(documents))
+                          for name, documents in inserts.items()]
+                writes += [self._write(name, self._repositories[name].upsert_many(
+                    list(documents.values())), len(documents))
+                    for name, documents in upserts.items()]
+                if writes:
+                    await asyncio.gather(*writes)
+                    self.stats["flushes"] += 1
+            finally:
+                # Free the slots even if the flush was cancelled, or producers wait forever
+                async with self._space:
+                    self._pending -= sum(len(docs) for docs in inserts.values()) + \
+                        sum(len(docs) for docs in upserts.values())
+                    self._space.notify_all()
+
+    async def close(self) -> None:
+        """
+        Stops the background flusher and writes whatever is still queued.
+        """
+        if self._flusher is not None:
+            async with self._flush_lock:
+                # Holding the lock means the flusher is not in the middle of a write
+                self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+
+# Shared by every ingestion job; flushed on shutdown by tasks.scheduler.stop_scheduler()
+write_buffer = WriteBehindBuffer()
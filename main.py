@@ -1,48 +1,83 @@
-from fastapi import FastAPI
-from tasks.scheduler import init_scheduler, stop_scheduler
-from db.database import get_database
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from tasks.http_cache import response_cache
+from tasks.http_session import init_session, close_session
+from tasks.scheduler import API_RUN_SCHEDULER, init_scheduler, stop_scheduler
+from db.database import init_client, close_client, get_database
+from db.indexes import ensure_collections, ensure_indexes
+from db.monitoring import ping_sample, sample_ping, start_health_sampler, stop_health_sampler, tag_queries
+from routes.debug import router as debug_router
+from routes.health import router as health_router
 from routes.prices import router as prices_router
 from routes.social import router as social_router
 from routes.investors import router as investors_router
+from routes.jobs import router as jobs_router
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Opens the shared MongoDB client and HTTP session on startup and closes them on shutdown.
+    With API_RUN_SCHEDULER=false no jobs start here: `python -m tasks.worker` runs them.
+    """
+    init_client()
+    if API_RUN_SCHEDULER:
+        init_session()
+        response_cache.load()
+        init_scheduler()  # Call without await since it's not an async function
+    db = get_database()
+
+    # Ping the database to ensure connection is successful
+    await sample_ping(db)
+    if not ping_sample["ok"]:
+        print(f"Error connecting to MongoDB: {ping_sample['error']}")
+    else:
+        try:
+            # Create any missing collections and indexes before the routes start querying
+            await ensure_collections(db)
+            await ensure_indexes(db)
+        except Exception as e:
+            print(f"Error creating MongoDB indexes: {e}")
+
+    # Keep the readiness samples fresh in the background
+    start_health_sampler(db)
+
+    yield
+
+    await stop_health_sampler()
+    if API_RUN_SCHEDULER:
+        await stop_scheduler()
+        response_cache.save()
+        await close_session()
+    close_client()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Include routers with specific prefixes and tags
+app.include_router(health_router, tags=["Health"])
+app.include_router(debug_router, prefix="/debug", tags=["Debug"])
 app.include_router(prices_router, prefix="/api", tags=["Prices"])
 app.include_router(social_router, prefix="/api", tags=["Social"])
 app.include_router(investors_router, prefix="/api", tags=["Investors"])
+app.include_router(jobs_router, prefix="/api", tags=["Jobs"])
 
 
-@app.on_event("startup")
-async def on_startup():
-    """
-    Event triggered when the application starts.
-    """
-    init_scheduler()  # Call without await since it's not an async function
-    try:
-        db = await get_database()
-        # Ping the database to ensure connection is successful
-        await db.command("ping")
-        app.state.db_connected = True
-    except Exception as e:
-        app.state.db_connected = False
-        print(f"Error connecting to MongoDB: {e}")
-
-
-@app.on_event("shutdown")
-async def on_shutdown():
+@app.middleware("http")
+async def tag_route_queries(request: Request, call_next):
     """
-    Event triggered when the application shuts down.
+    Attributes MongoDB commands issued while handling a request to its route.
     """
-    stop_scheduler()
+    with tag_queries(f"{request.method} {request.url.path}"):
+        return await call_next(request)
 
 
 @app.get("/")
 async def read_root():
     """
-    Root endpoint to test MongoDB connection.
+    Root endpoint to test MongoDB connection, based on the latest cached ping.
     """
-    if app.state.db_connected:
+    if ping_sample["ok"]:
         return {"message": "Connected to MongoDB successfully!"}
     else:
         return {"error": "Failed to connect to MongoDB"}
@@ -0,0 +1,53 @@
+from fastapi import APIRouter, Query
+from db.change_detection import change_detector
+from db.monitoring import command_stats
+from db.write_buffer import write_buffer
+from tasks.data_fetch import price_sources
+from tasks.http_cache import response_cache
+from tasks.http_session import connection_stats
+
+router = APIRouter()
+
+
+@router.get("/queries")
+async def get_query_stats(limit: int = Query(20, gt=0, le=500)):
+    """
+    Returns per-command latency histograms and the top query shapes by latency
+    and frequency, with the route or scheduler job that issued them.
+    """
+    return {
+        "histograms": command_stats.histograms(),
+        **command_stats.top_shapes(limit),
+    }
+
+
+@router.get("/writes")
+async def get_write_stats():
+    """
+    Returns per-collection written vs skipped (unchanged) counts for the last
+    tick and in total, plus the write buffer's counters.
+    """
+    return {
+        "change_detection": change_detector.counters,
+        "write_buffer": {**write_buffer.stats, **write_buffer.written.as_dict(),
+                         "failed": write_buffer.failed},
+    }
+
+
+@router.get("/http")
+async def get_http_stats():
+    """
+    Returns per-host upstream request counts, connection reuse of the shared session,
+    rate limiter queue times, conditional-request cache hits and price source hedging.
+    """
+    return {**connection_stats(), "cache": response_cache.as_dict(),
+            "price_sources": {source.name: source.snapshot() for source in price_sources}}
+
+
+@router.delete("/queries")
+async def reset_query_stats():
+    """
+    Clears the collected query statistics.
+    """
+    command_stats.reset()
+    return {"status": "reset"}
@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+from fastapi import APIRouter, Response
+from db.monitoring import HEALTH_PING_INTERVAL_SECONDS, ping_sample, pool_stats
+from db.repositories import LeaseRepository
+from tasks.circuit_breaker import circuit_breakers
+from tasks.leader import SCHEDULER_LEASE, scheduler_leader
+from tasks.scheduler import API_RUN_SCHEDULER, job_stats, scheduler
+
+router = APIRouter()
+
+# A ping sample older than this many intervals counts as stale
+STALE_SAMPLE_INTERVALS = 3
+
+
+@router.get("/healthz")
+async def healthz():
+    """
+    Liveness probe. Answers as long as the event loop is serving requests.
+    """
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz(response: Response):
+    """
+    Readiness probe. Reports the cached MongoDB ping, pool and scheduler samples
+    without touching the database.
+    """
+    now = datetime.now(timezone.utc)
+    sampled_at = ping_sample["sampled_at"]
+    sample_age = (now - sampled_at).total_seconds() if sampled_at else None
+    fresh = sample_age is not None and sample_age <= HEALTH_PING_INTERVAL_SECONDS * \
+        STALE_SAMPLE_INTERVALS
+
+    ready = ping_sample["ok"] and fresh
+    if not ready:
+        response.status_code = 503
+
+    return {
+        "status": "ready" if ready else "not_ready",
+        "mongo": {**ping_sample, "sample_age_seconds": sample_age},
+        "pools": pool_stats.snapshot(),
+        "scheduler": {
+            "enabled": API_RUN_SCHEDULER,
+            "running": scheduler.running,
+            "leader": scheduler_leader.is_leader,
+            "jobs": job_stats,
+        },
+        "upstreams": circuit_breakers.snapshot(),
+    }
+
+
+@router.get("/upstreams")
+async def upstreams():
+    """
+    Reports the circuit breaker state of every upstream host called so far.
+    Tick stages are skipped while a circuit they depend on is open.
+    """
+    return circuit_breakers.snapshot()
+
+
+@router.get("/leader")
+async def leader():
+    """
+    Reports which process holds the scheduler lease, and this process's view of it.
+    Only the lease holder runs the scheduled jobs.
+    """
+    try:
+        lease = await LeaseRepository().current(SCHEDULER_LEASE)
+        error = None
+    except Exception as e:
+        lease, error = None, str(e)
+    return {"lease": lease, "error": error, "this_process": scheduler_leader.snapshot()}
@@ -1,21 +1,27 @@
 from fastapi import APIRouter, Query, HTTPException
-from typing import List
+from typing import List, Optional
 from models.investor_model import InvestorModel
-from db.database import get_database
+from db.database import read_preference_from_env
+from db.repositories import InvestorRepository
 
 router = APIRouter()
 
+# Read routing for this router's GET endpoints, overridable via INVESTORS_READ_PREFERENCE
+READ_PREFERENCE = read_preference_from_env("INVESTORS")
+
 
 @router.get("/investors", response_model=List[InvestorModel])
-async def get_investors(coin_symbol: str = Query(..., alias="coin_symbol")):
+async def get_investors(
+    coin_symbol: str = Query(..., alias="coin_symbol"),
+    after: Optional[str] = Query(
+        None, description="Return investors whose name sorts after this one (keyset paging)."),
+    limit: int = Query(100, gt=0, le=1000)
+):
     """
     Возвращает список инвесторов для указанного символа монеты.
     """
-    db = get_database()
-
-    # Fetch investors data from the database (MongoDB)
-    investors_cursor = db.investors.find({"coin_symbol": coin_symbol})
-    investors_list = await investors_cursor.to_list(length=100)
+    investors_list = await InvestorRepository(read_preference=READ_PREFERENCE).find_by_coin(
+        coin_symbol, after=after, limit=limit)
 
     if not investors_list:
         raise HTTPException(
@@ -29,13 +35,8 @@ async def create_investor(investor: InvestorModel):
     """
     Добавляет нового инвестора в базу данных для указанного символа монеты.
     """
-    db = get_database()
-
     # Insert the new investor into the 'investors' collection
-    result = await db.investors.insert_one(investor.dict())
-
-    # Fetch the inserted investor from the database
-    new_investor = await db.investors.find_one({"_id": result.inserted_id})
+    new_investor = await InvestorRepository().insert_one(investor.dict())
 
     if not new_investor:
         raise HTTPException(
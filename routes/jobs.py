@@ -0,0 +1,72 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Any, Dict, List, Optional
+from db.monitoring import percentile
+from db.repositories import JobRunRepository
+
+router = APIRouter()
+
+
+def _p50_p95(values: List[float]) -> Dict[str, Optional[float]]:
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95)}
+
+
+def summarize_runs(runs: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Groups runs by job and returns run counts by status, and p50/p95 of the run
+    duration and of each stage's duration and phases, in seconds.
+    """
+    by_job: Dict[str, List[Dict[str, Any]]] = {}
+    for run in runs:
+        by_job.setdefault(run["job_id"], []).append(run)
+
+    summaries = {}
+    for job_id, job_runs in by_job.items():
+        statuses: Dict[str, int] = {}
+        stage_durations: Dict[str, List[float]] = {}
+        stage_phases: Dict[str, Dict[str, List[float]]] = {}
+        for run in job_runs:
+            statuses[run["status"]] = statuses.get(run["status"], 0) + 1
+            for name, stage in run.get("stages", {}).items():
+                if stage.get("duration_seconds") is not None:
+                    stage_durations.setdefault(name, []).append(stage["duration_seconds"])
+                for phase, seconds in stage.get("phases", {}).items():
+                    stage_phases.setdefault(name, {}).setdefault(phase, []).append(seconds)
+
+        summaries[job_id] = {
+            "runs": len(job_runs),
+            "statuses": statuses,
+            "duration_seconds": _p50_p95([run["duration_seconds"] for run in job_runs]),
+            "stages": {
+                name: {
+                    "duration_seconds": _p50_p95(stage_durations.get(name, [])),
+                    "phases_seconds": {phase: _p50_p95(values) for phase, values
+                                       in stage_phases.get(name, {}).items()},
+                }
+                for name in sorted(set(stage_durations) | set(stage_phases))
+            },
+        }
+    return summaries
+
+
+@router.get("/jobs")
+async def get_jobs(
+    job_id: Optional[str] = Query(
+        None, description="Only return runs of this job (e.g. 'tick')."),
+    limit: int = Query(
+        20, gt=0, le=500, description="Number of recent runs to return (default: 20)."),
+    window: int = Query(
+        200, gt=0, le=5000, description="Number of recent runs the percentiles are computed over."),
+):
+    """
+    Returns the most recent scheduler job runs, newest first, and per job the
+    p50/p95 durations of the run and of each stage over the last `window` runs.
+    """
+    try:
+        runs = await JobRunRepository().find_recent(job_id, limit=max(limit, window))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail="An error occurred while fetching job runs."
+        ) from e
+
+    return {"jobs": summarize_runs(runs[:window]), "runs": runs[:limit]}
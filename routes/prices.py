@@ -1,11 +1,17 @@
+from datetime import datetime
 from fastapi import APIRouter, HTTPException, Query
-from typing import List
+from typing import List, Optional
 # Ensure this model is properly defined
 from models.price_model import PriceModel
-from db.database import get_database  # Import the database connection function
+from db.database import read_preference_from_env
+from db.repositories import PriceRepository
 
 router = APIRouter()
 
+# Reads may be served by a secondary lagging at most PRICES_MAX_STALENESS_SECONDS
+READ_PREFERENCE = read_preference_from_env(
+    "PRICES", default_mode="secondaryPreferred", default_max_staleness=90)
+
 
 @router.get("/prices", response_model=List[PriceModel])
 async def get_prices(
@@ -14,39 +20,30 @@ async def get_prices(
     min_price: float = Query(
         0, ge=0, description="The minimum price for filtering (default: 0)."),
     max_price: float = Query(
-        0.1, gt=0, description="The maximum price for filtering (default: 0.1).")
+        0.1, gt=0, description="The maximum price for filtering (default: 0.1)."),
+    before: Optional[datetime] = Query(
+        None, description="Return prices older than this timestamp (keyset paging)."),
+    limit: int = Query(
+        100, gt=0, le=1000, description="Maximum number of prices to return (default: 100).")
 ):
     """
     Fetch price data for the specified cryptocurrency symbol with dynamic filtering for min/max price.
     """
     try:
-        # Initialize the database connection
-        db = get_database()
-
-        # Build the query dynamically based on the provided filters
-        query = {"symbol": symbol}
-        if min_price is not None:
-            query["price"] = {"$gte": min_price}
-        if max_price is not None:
-            query["price"] = query.get("price", {})
-            query["price"]["$lte"] = max_price
-
-        # Query MongoDB with the constructed filter
-        prices_cursor = db.prices.find(query)
-        prices_list = await prices_cursor.to_list(length=100)
-
-        # Handle case where no data is found
-        if not prices_list:
-            raise HTTPException(
-                status_code=404,
-                detail=f"No price data found for the symbol: {symbol} with the given filters."
-            )
-
-        return prices_list
-
+        prices_list = await PriceRepository(read_preference=READ_PREFERENCE).find_by_symbol(
+            symbol, min_price=min_price, max_price=max_price, before=before, limit=limit)
     except Exception as e:
         # Log the exception and return a server error response
         raise HTTPException(
             status_code=500,
             detail="An error occurred while fetching price data."
         ) from e
+
+    # Handle case where no data is found
+    if not prices_list:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No price data found for the symbol: {symbol} with the given filters."
+        )
+
+    return prices_list
@@ -1,26 +1,30 @@
-from db.database import get_database
-from fastapi import APIRouter, HTTPException
+from datetime import datetime
+from db.database import read_preference_from_env
+from db.repositories import SocialRepository
+from fastapi import APIRouter, HTTPException, Query
 from models.social_model import SocialModel
-from pymongo import MongoClient
 from pydantic import ValidationError
-from typing import List
+from typing import List, Optional
 
 router = APIRouter()
 
-# Подключение к базе данных
-db = get_database()
+# Reads may be served by a secondary lagging at most SOCIAL_MAX_STALENESS_SECONDS
+READ_PREFERENCE = read_preference_from_env(
+    "SOCIAL", default_mode="secondaryPreferred", default_max_staleness=90)
 
 
 @router.get("/social", response_model=List[SocialModel])
-async def get_social_trends(symbol: str):
+async def get_social_trends(
+    symbol: str,
+    before: Optional[datetime] = Query(
+        None, description="Return trends older than this timestamp (keyset paging)."),
+    limit: int = Query(100, gt=0, le=1000)
+):
     """
     Получить данные социальных трендов для указанного символа криптовалюты.
     """
-    # Fetch data based on the 'symbol' query parameter
-    trends_cursor = db.social_trends.find({"symbol": symbol})
-
-    # Convert the cursor to a list with a limit on the number of documents to fetch
-    trends_list = await trends_cursor.to_list(length=100)
+    trends_list = await SocialRepository(read_preference=READ_PREFERENCE).find_by_symbol(
+        symbol, before=before, limit=limit)
 
     if not trends_list:
         raise HTTPException(
@@ -33,16 +37,7 @@ async def get_social_trends(symbol: str):
 async def create_social_trend(trend: SocialModel):
     try:
         # Insert the trend into the database
-        inserted = await db.social_trends.insert_one(trend.dict())
-
-        # Fetch the inserted document
-        new_trend = await db.social_trends.find_one({"_id": inserted.inserted_id})
-
-        # Check if the new trend is returned
-        if new_trend is None:
-            raise HTTPException(
-                status_code=500, detail="Failed to insert data"
-            )
+        new_trend = await SocialRepository().insert_one(trend.dict())
 
         # Log the inserted data for debugging
         print(f"Inserted data: {new_trend}")
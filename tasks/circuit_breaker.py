@@ -0,0 +1,154 @@
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Number of recent calls the error rate is computed over
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+# Calls needed in the window before the breaker may open
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+# Share of failed (or too slow) calls in the window that opens the breaker
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+# Calls slower than this count as failures
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "10"))
+# How long an open breaker rejects calls before letting a trial call through
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "60"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request to an upstream whose breaker is open.
+    """
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"Circuit for {host} is open, retry in {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open breaker for one upstream host. It opens when the share
+    of failed or slow calls in the recent window reaches the error rate, rejects
+    calls while open, and then lets a single trial call decide whether to close.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=BREAKER_WINDOW)
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _transition(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"Circuit for {self.host}: {self.state} -> {state}")
+            self.state = state
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + BREAKER_OPEN_SECONDS - time.monotonic())
+
+    def available(self) -> bool:
+        """
+        Whether a call would currently be let through, without reserving it.
+        """
+        if self.state == OPEN:
+            return self.retry_in() == 0
+        if self.state == HALF_OPEN:
+            return not self.trial_in_flight
+        return True
+
+    def before_call(self) -> None:
+        """
+        Raises CircuitOpenError if the call must not be sent.
+        """
+        if self.state == OPEN and self.retry_in() == 0:
+            self._transition(HALF_OPEN)
+        if self.state == OPEN or (self.state == HALF_OPEN and self.trial_in_flight):
+            self.rejected += 1
+            raise CircuitOpenError(self.host, self.retry_in())
+        if self.state == HALF_OPEN:
+            self.trial_in_flight = True
+
+    def abandon(self) -> None:
+        """
+        Forgets a call that was let through but never completed, e.g. cancelled.
+        """
+        self.trial_in_flight = False
+
+    def record(self, ok: bool, seconds: float) -> None:
+        """
+        Records the outcome of a call that before_call() let through.
+        """
+        failed = not ok or seconds >= BREAKER_SLOW_CALL_SECONDS
+        if self.state == HALF_OPEN:
+            self.trial_in_flight = False
+            if failed:
+                self._open()
+            else:
+                self.outcomes.clear()
+                self._transition(CLOSED)
+            return
+
+        self.outcomes.append(failed)
+        if (self.state == CLOSED and len(self.outcomes) >= BREAKER_MIN_CALLS
+                and sum(self.outcomes) / len(self.outcomes) >= BREAKER_ERROR_RATE):
+            self._open()
+
+    def _open(self) -> None:
+        self.opened_at = time.monotonic()
+        self.times_opened += 1
+        self._transition(OPEN)
+
+    def snapshot(self) -> Dict[str, Any]:
+        failures = sum(self.outcomes)
+        return {
+            "state": self.state,
+            "error_rate": failures / len(self.outcomes) if self.outcomes else None,
+            "calls_in_window": len(self.outcomes),
+            "retry_in_seconds": self.retry_in() if self.state != CLOSED else None,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class BreakerRegistry:
+    """
+    One breaker per upstream host, created on first use.
+    """
+
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(host)
+            self.breakers[host] = breaker
+        return breaker
+
+    def first_unavailable(self, hosts: Iterable[str]) -> Optional[CircuitBreaker]:
+        """
+        Returns the breaker of the first host that would reject a call, if any.
+        """
+        for host in hosts:
+            breaker = self.breakers.get(host)
+            if breaker is not None and not breaker.available():
+                return breaker
+        return None
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {host: breaker.snapshot() for host, breaker in self.breakers.items()}
+
+
+# Consulted by tasks.http_session.upstream_request() and by the tick graph before each stage
+circuit_breakers = BreakerRegistry()
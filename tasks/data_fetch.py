@@ -1,34 +1,59 @@
 import aiohttp
+import asyncio
+from contextlib import aclosing
 from datetime import datetime, timezone
 import logging
 import os
-from db.db_utils import get_collection
-from pymongo.collection import Collection
-from typing import Any, List, Dict
+import time
+from db.repositories import (
+    PriceRepository,
+    SocialRepository,
+    InvestorRepository,
+    MarketRepository,
+)
+from db.change_detection import change_detector
+from db.write_buffer import write_buffer
+from tasks.deadline import (
+    DeadlineExceeded,
+    current_run,
+    deadline_passed,
+    gather_until_deadline,
+    remaining_budget,
+)
+from tasks.http_cache import iter_json
+from tasks.http_session import upstream_request
+from tasks.json_decode import iter_json_items, read_json
+from tasks.price_sources import (
+    PricesUnavailableError,
+    create_price_sources,
+    exchange_symbols,
+    fetch_consensus,
+)
+from tasks.run_metrics import count, note_error, phase
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
 from dotenv import load_dotenv
 
 from models.social_model import SocialModel
-from motor.motor_asyncio import AsyncIOMotorClient
-
-MONGO_URI = "your_mongo_uri"
-MONGO_DB_NAME = "your_database_name"
-
-client = AsyncIOMotorClient(MONGO_URI)
-
-
-async def get_db():
-    return client[MONGO_DB_NAME]
 
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; LOG_LEVEL=DEBUG also logs every library's debug output
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Reddit credentials from environment variables
 REDDIT_CLIENT_ID = os.getenv('REDDIT_CLIENT_ID')
 REDDIT_CLIENT_SECRET = os.getenv('REDDIT_CLIENT_SECRET')
 REDDIT_USER_AGENT = os.getenv('REDDIT_USER_AGENT')
+# Subreddits read each run, fetched concurrently
+REDDIT_SUBREDDITS = [name.strip() for name in os.getenv(
+    'REDDIT_SUBREDDITS', 'cryptocurrency,CryptoMarkets,Bitcoin,ethereum').split(',') if name.strip()]
+# Listing read per subreddit; 'new' is ordered by creation time, which the high-water marks rely on
+REDDIT_LISTING = os.getenv('REDDIT_LISTING', 'new')
+REDDIT_PAGE_LIMIT = 100
+REDDIT_MAX_PAGES = int(os.getenv('REDDIT_MAX_PAGES', '5'))
+# The OAuth token is refreshed this long before Reddit says it expires
+REDDIT_TOKEN_REFRESH_MARGIN_SECONDS = 60
 
 # Default filter values
 DEFAULT_MIN_PRICE = 0
@@ -36,51 +61,134 @@ DEFAULT_MAX_PRICE = 1  # Set default maximum price to 0.1
 MIN_MARKET_CAP = 100_000_000
 MIN_VOLUME = 50_000
 
-# Function to fetch prices from CoinGecko
+# Upstream endpoints; point them at `python -m tasks.upstream_standin` for local load tests
+COINGECKO_API_URL = os.getenv("COINGECKO_API_URL", "https://api.coingecko.com/api/v3")
+REDDIT_TOKEN_URL = os.getenv("REDDIT_TOKEN_URL", "https://www.reddit.com/api/v1/access_token")
+REDDIT_API_URL = os.getenv("REDDIT_API_URL", "https://oauth.reddit.com")
+# Placeholder API URL
+INVESTORS_API_URL = os.getenv(
+    "INVESTORS_API_URL", "https://api.some-crypto-investor-api.com/investors")
+# Ids priced when the market universe hasn't been fetched yet
+DEFAULT_PRICE_IDS = os.getenv("DEFAULT_PRICE_IDS", "bitcoin,ethereum,cardano").split(",")
+# /coins/markets paging: 250 is the largest page CoinGecko serves
+MARKET_PAGE_SIZE = 250
+MARKET_MAX_PAGES = int(os.getenv("MARKET_MAX_PAGES", "20"))
+# Upstream pages/chunks requested at the same time; the rate limiter still paces them
+MARKET_FETCH_CONCURRENCY = int(os.getenv("MARKET_FETCH_CONCURRENCY", "4"))
+# Longest /simple/price URL we send; the id list is split to stay under it
+SIMPLE_PRICE_MAX_URL_LENGTH = int(os.getenv("SIMPLE_PRICE_MAX_URL_LENGTH", "2000"))
+
+# Every coin seen in the last full /coins/markets pass, in market cap order:
+# {coin_id: {"symbol", "market_cap", "total_volume"}}
+market_universe: Dict[str, Dict[str, Any]] = {}
+
+# CoinGecko plus exchange tickers, asked in order with hedging by fetch_prices
+price_sources = create_price_sources(COINGECKO_API_URL)
+
+# Application-only Reddit OAuth token, shared by every run until it is about to expire
+_reddit_token: Dict[str, Any] = {"access_token": None, "expires_at": 0.0}
+_reddit_token_lock = asyncio.Lock()
+# Newest post processed per listing, so each run only processes newer posts
+reddit_high_water: Dict[str, Dict[str, Any]] = {}
+
+def chunk_ids(ids: List[str], max_url_length: int = SIMPLE_PRICE_MAX_URL_LENGTH) -> List[List[str]]:
+    """
+    Splits coin ids into comma-joined lists that keep a /simple/price URL under max_url_length.
+    """
+    # Room for the endpoint and the other query parameters
+    budget = max_url_length - len(f"{COINGECKO_API_URL}/simple/price") - 150
+    chunks: List[List[str]] = []
+    current: List[str] = []
+    length = 0
+    for coin_id in ids:
+        # Commas are sent percent-encoded, three characters each
+        added = len(coin_id) + (3 if current else 0)
+        if current and length + added > budget:
+            chunks.append(current)
+            current, length = [], 0
+            added = len(coin_id)
+        current.append(coin_id)
+        length += added
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def queue_changed(repository, key_field: str, documents: List[Dict],
+                        inserts: bool = False, store_hash: bool = True) -> List[Dict]:
+    """
+    Queues the documents that changed since they were last written and counts
+    them, and the unchanged ones skipped, for the job run's history.
+    """
+    with phase("write"):
+        changed = change_detector.filter_changed(
+            repository, key_field, documents, store_hash=store_hash)
+        if inserts:
+            await write_buffer.add_inserts(repository, changed)
+        else:
+            await write_buffer.add_upserts(repository, changed)
+    count("written", len(changed))
+    count("skipped", len(documents) - len(changed))
+    return changed
 
+# Function to fetch prices from CoinGecko
 
-async def fetch_prices(min_price: float = DEFAULT_MIN_PRICE, max_price: float = DEFAULT_MAX_PRICE):
-    try:
-        url = "https://api.coingecko.com/api/v3/simple/price"
-        params = {"ids": "bitcoin,ethereum,cardano", "vs_currencies": "usd",
-                  "include_market_cap": "true", "include_24hr_vol": "true"}
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"Fetched price data: {data}")
+async def fetch_prices(min_price: float = DEFAULT_MIN_PRICE, max_price: float = DEFAULT_MAX_PRICE,
+                       ids: Optional[List[str]] = None,
+                       session: Optional[aiohttp.ClientSession] = None):
+    """
+    Prices every tracked coin in URL-sized id chunks, a few at a time, and saves
+    each chunk's filtered prices as soon as it arrives. Each chunk is priced by the
+    median of the hedged price sources that answered (see tasks.price_sources).
+    Chunks still unpriced at the job's deadline are dropped; saved ones are kept.
+    """
+    ids = ids or list(market_universe) or DEFAULT_PRICE_IDS
+    symbols = exchange_symbols(market_universe)
+    semaphore = asyncio.Semaphore(MARKET_FETCH_CONCURRENCY)
+
+    async def fetch_chunk(chunk: List[str]):
+        try:
+            async with semaphore:
+                data = await fetch_consensus(chunk, symbols, price_sources, session=session)
+            if data:
+                logger.info(f"Fetched prices for {len(data)} of {len(chunk)} coins.")
+                count("read", len(data))
+                with phase("validate"):
+                    # Exchange quotes carry no market data; use the last market listing's
+                    for coin_id, coin_data in data.items():
+                        listed = market_universe.get(coin_id, {})
+                        coin_data.setdefault("usd_market_cap", listed.get("market_cap"))
+                        coin_data.setdefault("usd_24h_vol", listed.get("total_volume"))
 
                     # Filter data based on conditions
                     filtered_data = filter_prices(data, min_price, max_price)
-                    if filtered_data:
-                        # Log filtered data
-                        logger.info(f"Filtered data: {filtered_data}")
-                        await save_prices_to_db(filtered_data)
-                    else:
-                        logger.info(
-                            "No data after filtering based on conditions.")
+                if filtered_data:
+                    logger.info(f"Filtered data: {len(filtered_data)} coins.")
+                    # Priced chunks are stored even if the job is cancelled meanwhile
+                    await asyncio.shield(save_prices_to_db(filtered_data))
                 else:
-                    logger.error(
-                        f"Failed to fetch prices. Status: {response.status}")
-    except Exception as e:
-        logger.exception("Error in fetch_prices")
-
+                    logger.info(
+                        "No data after filtering based on conditions.")
+            elif deadline_passed():
+                raise DeadlineExceeded(f"{len(chunk)} coins weren't priced before the deadline")
+            else:
+                error = PricesUnavailableError(
+                    f"No price source could price any of {len(chunk)} coins")
+                note_error(error)
+                logger.error(f"{error}.")
+                run = current_run()
+                if run is not None:
+                    run.mark_partial(str(error))
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            note_error(e)
+            logger.exception("Error in fetch_prices")
+
+    await gather_until_deadline(*(fetch_chunk(chunk) for chunk in chunk_ids(ids)),
+                                what="price chunks")
 
-async def get_collection(collection_name: str):
-    try:
-        db = await get_db()  # Assuming get_db() is the function that retrieves the DB
-        collection = db[collection_name]
-        if not collection:
-            logger.error(f"Collection '{collection_name}' not found.")
-        else:
-            logger.info(
-                f"Successfully retrieved collection: {collection_name}")
-        return collection
-    except Exception as e:
-        logger.exception(
-            f"Error while getting collection '{collection_name}': {e}")
-        return None  # Ensure we return None if an error occurs
 
 # Function to filter fetched prices based on market cap, volume, and price range
 
@@ -88,9 +196,12 @@ async def get_collection(collection_name: str):
 def filter_prices(data: Dict, min_price: float, max_price: float) -> Dict:
     filtered = {}
     for coin_id, coin_data in data.items():
+        # Coins without trading data come back without a price or with nulls
+        if coin_data.get("usd") is None:
+            continue
         if (min_price <= coin_data["usd"] <= max_price and
-            coin_data.get("usd_market_cap", 0) >= MIN_MARKET_CAP and
-                coin_data.get("usd_24h_vol", 0) >= MIN_VOLUME):
+            (coin_data.get("usd_market_cap") or 0) >= MIN_MARKET_CAP and
+                (coin_data.get("usd_24h_vol") or 0) >= MIN_VOLUME):
             filtered[coin_id] = coin_data
     return filtered
 
@@ -103,143 +214,245 @@ async def save_prices_to_db(data: Any) -> None:
             logger.error("No data provided for saving prices.")
             return
 
-        # Check if the data is in the expected format
-        logger.info(f"Data to save: {data}")
-
-        # Get MongoDB collection
-        collection = await get_collection("prices")
-
-        # Log the collection to ensure it's valid
-        logger.info(f"Using collection: {collection}")
+        logger.debug(f"Prices to save: {len(data)} coins.")
 
-        # Insert data into the database
-        result = await collection.insert_one({
-            "data": data,
-            "timestamp": datetime.now(timezone.utc)
-        })
+        # Queue one tick per symbol for the time-series collection
+        with phase("validate"):
+            ticks = PriceRepository.ticks_from_snapshot(
+                data, datetime.now(timezone.utc))
+        # Quiet coins keep the same price between ticks; don't store repeats
+        ticks = await queue_changed(
+            PriceRepository(), "symbol", ticks, inserts=True, store_hash=False)
 
-        logger.info(f"Prices saved successfully with id: {result.inserted_id}")
+        logger.info(f"Prices queued for saving: {len(ticks)} ticks.")
     except Exception as e:
+        note_error(e)
         logger.exception("Failed to save prices to DB")
 
 
 # Function to fetch social trends data from Reddit and store it in MongoDB
 
 
-async def fetch_and_store_social_data():
-    try:
+async def get_reddit_token(session: Optional[aiohttp.ClientSession] = None,
+                           force_refresh: bool = False) -> Optional[str]:
+    """
+    Returns the cached Reddit access token, requesting a new one only when it is
+    missing, about to expire, or was rejected (force_refresh).
+    """
+    async with _reddit_token_lock:
+        if (not force_refresh and _reddit_token["access_token"]
+                and time.time() < _reddit_token["expires_at"]):
+            return _reddit_token["access_token"]
+
         # Get access token from Reddit using client credentials
         auth = aiohttp.BasicAuth(REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET)
-        token_url = "https://www.reddit.com/api/v1/access_token"
+        token_url = REDDIT_TOKEN_URL
         headers = {'User-Agent': REDDIT_USER_AGENT}
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(token_url, data={'grant_type': 'client_credentials'},
+        async with upstream_request("POST", token_url, session=session,
+                                    data={'grant_type': 'client_credentials'},
                                     auth=auth, headers=headers) as response:
-                if response.status == 200:
-                    token_data = await response.json()
-                    access_token = token_data.get('access_token')
-
-                    if not access_token:
-                        logger.error("No access token received.")
-                        return
-
-                    logger.info("Successfully retrieved access token.")
-                    # Fetch top posts from /r/cryptocurrency
-                    reddit_url = "https://oauth.reddit.com/r/cryptocurrency/top"
-                    headers['Authorization'] = f"bearer {access_token}"
-
-                    async with session.get(reddit_url, headers=headers) as reddit_response:
-                        if reddit_response.status == 200:
-                            data = await reddit_response.json()
-                            logger.info(f"Reddit response fetched: {data}")
-
-                            # Extract posts data
-                            children = data.get("data", {}).get("children", [])
-
-                            if not isinstance(children, list):
-                                logger.warning(
-                                    "Invalid 'children' format in response.")
-                                return
-
-                            collection = await get_collection("social_trends")
-
-                            for item in children:
-                                post_data = item.get("data", {})
-
-                                # Ensure required fields are present
-                                if "id" not in post_data:
-                                    logger.warning(
-                                        f"Post missing 'id': {post_data}")
-                                    continue
-
-                                # Map Reddit data to SocialModel fields
-                                social_entry = {
-                                    "symbol": post_data.get("title", "Unknown"),
-                                    "platform": "Reddit",
-                                    "followers": post_data.get("num_comments", 0),
-                                    "engagement": post_data.get("ups", 0) / max(post_data.get("num_comments", 1), 1),
-                                    "timestamp": datetime.now(),
-                                    "trend": "Neutral",
-                                    "mentions": post_data.get("num_comments", 0),
-                                    "positive_sentiment": 0.5,
-                                    "date": datetime.now(),
-                                }
-
-                                # Create SocialModel instance and validate
-                                try:
-                                    social_entry_model = SocialModel(
-                                        **social_entry)
-                                except ValueError as e:
-                                    logger.error(
-                                        f"Error validating social entry: {e}")
-                                    continue
-
-                                # Insert or update in MongoDB
-                                result = await collection.update_one(
-                                    {"id": post_data["id"]},
-                                    {"$set": social_entry_model.model_dump()},
-                                    upsert=True
-                                )
-
-                                if result.modified_count == 0:
-                                    logger.warning(
-                                        f"Social entry with id {post_data['id']} was not updated.")
-                                else:
-                                    logger.info(
-                                        f"Social entry with id {post_data['id']} was updated.")
-
-                            logger.info(
-                                "Social trends data stored successfully.")
-                        else:
-                            logger.error(
-                                f"Failed to fetch social data. Status: {reddit_response.status}")
-                else:
-                    logger.error(
-                        f"Failed to authenticate. Status: {response.status}")
+            if response.status != 200:
+                logger.error(
+                    f"Failed to authenticate. Status: {response.status}")
+                return None
+            token_data = await read_json(response)
+
+        access_token = token_data.get('access_token')
+        if not access_token:
+            logger.error("No access token received.")
+            return None
+
+        expires_in = token_data.get('expires_in', 3600)
+        _reddit_token.update(
+            access_token=access_token,
+            expires_at=time.time() + expires_in - REDDIT_TOKEN_REFRESH_MARGIN_SECONDS)
+        logger.info(f"Retrieved Reddit access token, valid for {expires_in}s.")
+        return access_token
+
+
+async def iter_reddit_posts(path: str, params: Dict[str, Any],
+                            session: Optional[aiohttp.ClientSession] = None) -> AsyncIterator[Dict]:
+    """
+    Streams the posts of one oauth.reddit.com listing page with the cached token,
+    refreshing it once if Reddit rejects it. Other non-200 statuses raise
+    aiohttp.ClientResponseError.
+    """
+    for force_refresh in (False, True):
+        access_token = await get_reddit_token(session, force_refresh=force_refresh)
+        if not access_token:
+            raise RuntimeError("No Reddit access token available.")
+        headers = {'User-Agent': REDDIT_USER_AGENT,
+                   'Authorization': f"bearer {access_token}"}
+        async with upstream_request("GET", f"{REDDIT_API_URL}{path}", session=session,
+                                    params=params, headers=headers) as response:
+            if response.status == 401 and not force_refresh:
+                continue
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history, status=response.status,
+                    message="Unexpected upstream status", headers=response.headers)
+            async for child in iter_json_items(response, "data.children.item"):
+                yield child.get("data", {})
+            return
+
+
+async def fetch_new_posts(subreddit: str, session: Optional[aiohttp.ClientSession] = None
+                          ) -> Tuple[List[Dict], Optional[Dict[str, Any]]]:
+    """
+    Pages through a subreddit listing until it reaches the listing's high-water
+    mark, validating posts as they are decoded. Returns (entries, new high-water mark).
+    The mark is None, so the old one is kept, when REDDIT_MAX_PAGES ran out before
+    the old mark was reached: the posts in between would otherwise never be read.
+    """
+    path = f"/r/{subreddit}/{REDDIT_LISTING}"
+    mark = reddit_high_water.get(path)
+    entries: List[Dict] = []
+    newest = None
+    after = None
+    for _ in range(REDDIT_MAX_PAGES):
+        params = {"limit": REDDIT_PAGE_LIMIT, "raw_json": 1}
+        if after:
+            params["after"] = after
+
+        listed = 0
+        reached_mark = False
+        async with aclosing(iter_reddit_posts(path, params, session)) as posts:
+            async for post_data in posts:
+                listed += 1
+                if mark and (post_data.get("name") == mark["fullname"]
+                             or post_data.get("created_utc", 0) < mark["created_utc"]):
+                    reached_mark = True
+                    break
+                if newest is None:
+                    newest = {"fullname": post_data.get("name"),
+                              "created_utc": post_data.get("created_utc", 0)}
+                after = post_data.get("name")
+                with phase("validate"):
+                    entry = social_entry_from_post(post_data)
+                if entry is not None:
+                    entries.append(entry)
+        count("read", listed)
+
+        # Reddit's `after` cursor is the fullname of the page's last post
+        if reached_mark or listed < REDDIT_PAGE_LIMIT or not after:
+            break
+    else:
+        if mark:
+            logger.warning(f"{path} has more than {REDDIT_MAX_PAGES} pages of new posts; "
+                           f"keeping its high-water mark.")
+            run = current_run()
+            if run is not None:
+                run.mark_partial(f"{path} not read back to its high-water mark")
+            return entries, None
+    return entries, newest
+
+
+def social_entry_from_post(post_data: Dict) -> Optional[Dict]:
+    """
+    Maps a Reddit post to a social_trends document, or None if it is invalid.
+    """
+    # Ensure required fields are present
+    if "id" not in post_data:
+        logger.warning(f"Post missing 'id': {post_data.get('name')}")
+        return None
+
+    # Map Reddit data to SocialModel fields
+    social_entry = {
+        "symbol": post_data.get("title", "Unknown"),
+        "platform": "Reddit",
+        "followers": post_data.get("num_comments", 0),
+        "engagement": post_data.get("ups", 0) / max(post_data.get("num_comments", 1), 1),
+        "timestamp": datetime.now(),
+        "trend": "Neutral",
+        "mentions": post_data.get("num_comments", 0),
+        "positive_sentiment": 0.5,
+        "date": datetime.now(),
+    }
+
+    # Create SocialModel instance and validate
+    try:
+        social_entry_model = SocialModel(**social_entry)
+    except ValueError as e:
+        logger.error(f"Error validating social entry: {e}")
+        return None
+
+    return {"id": post_data["id"], "subreddit": post_data.get("subreddit"),
+            **social_entry_model.model_dump()}
+
+
+async def fetch_and_store_social_data(session: Optional[aiohttp.ClientSession] = None):
+    """
+    Fetches the posts added to every configured subreddit since the previous run
+    and stores them. High-water marks only advance for listings that were fetched
+    completely, and once the posts are written; subreddits still loading at the
+    job's deadline, and posts whose write failed, are left for the next run.
+    """
+    try:
+        results = await gather_until_deadline(
+            *(fetch_new_posts(subreddit, session) for subreddit in REDDIT_SUBREDDITS),
+            what="subreddits")
+
+        entries = []
+        marks = {}
+        for subreddit, result in zip(REDDIT_SUBREDDITS, results):
+            if isinstance(result, DeadlineExceeded):
+                logger.warning(f"r/{subreddit} wasn't fetched before the deadline.")
+                continue
+            if isinstance(result, Exception):
+                note_error(result)
+                logger.error(f"Error fetching r/{subreddit}: {result!r}")
+                continue
+            new_entries, newest = result
+            entries.extend(new_entries)
+            if newest is not None:
+                marks[f"/r/{subreddit}/{REDDIT_LISTING}"] = newest
+            logger.info(f"Fetched {len(new_entries)} new posts from r/{subreddit}.")
+
+        # Queue the changed posts; the write buffer sends them in bulk
+        repository = SocialRepository()
+        failed = write_buffer.failed.get(repository.collection_name, 0)
+        entries = await queue_changed(repository, "id", entries)
+        # The marks may only move past posts that are stored
+        with phase("write"):
+            await write_buffer.flush()
+        if write_buffer.failed.get(repository.collection_name, 0) > failed:
+            logger.error("Storing social posts failed; keeping the high-water marks.")
+            run = current_run()
+            if run is not None:
+                run.mark_partial("social posts not stored")
+        else:
+            reddit_high_water.update(marks)
+        logger.info(
+            f"Social trends data queued for storing: {len(entries)} posts.")
     except Exception as e:
+        note_error(e)
         logger.error(f"Error fetching or storing social data: {e}")
 
 # Fetch and store investor data
 
 
-async def fetch_investors():
+async def fetch_investors(session: Optional[aiohttp.ClientSession] = None) -> Optional[Dict]:
+    """
+    Fetches the investor listing for store_investor_data, or returns None if the request failed.
+    """
     try:
-        # Placeholder API URL
-        url = "https://api.some-crypto-investor-api.com/investors"
+        url = INVESTORS_API_URL
         params = {"crypto": "bitcoin,ethereum,cardano"}
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"Fetched investor data: {data}")
-                    await store_investor_data(data)
-                else:
-                    logger.error(
-                        f"Failed to fetch investor data. Status: {response.status}")
+        async with upstream_request("GET", url, session=session, params=params) as response:
+            if response.status == 200:
+                data = await read_json(response)
+                logger.info(
+                    f"Fetched investor data: {len(data.get('investors', []))} investors.")
+                count("read", len(data.get("investors", [])))
+                return data
+            else:
+                logger.error(
+                    f"Failed to fetch investor data. Status: {response.status}")
     except Exception as e:
+        note_error(e)
         logger.error(f"Error in fetch_investors: {e}")
+    return None
 
 # Store investor data to MongoDB
 
@@ -252,8 +465,7 @@ async def store_investor_data(data):
             logger.warning("Investors data is not a list.")
             return
 
-        collection = await get_collection("investors")
-
+        entries = []
         for investor in investors:
             if "name" not in investor:
                 logger.warning(f"Missing 'name' field in investor: {investor}")
@@ -266,71 +478,176 @@ async def store_investor_data(data):
                 "fetched_at": datetime.now(timezone.utc),
             }
 
-            await collection.update_one(
-                {"name": investor_entry["name"]},
-                {"$set": investor_entry},
-                upsert=True
-            )
+            entries.append(investor_entry)
 
-        logger.info("Investor data stored successfully.")
+        entries = await queue_changed(InvestorRepository(), "name", entries)
+        logger.info(f"Investor data queued for storing: {len(entries)} investors.")
     except Exception as e:
+        note_error(e)
         logger.error(f"Failed to store investor data: {e}")
 
 # Filter cryptocurrencies based on parameters
 
 
-async def filter_currencies_based_on_params(min_price: float, max_price: float) -> List[Dict]:
+def market_document(coin: Dict, min_price: float, max_price: float,
+                    fetched_at: datetime) -> Optional[Dict]:
+    """
+    Returns the market_snapshots document for a /coins/markets entry that meets
+    the price, market cap and volume criteria, or None.
     """
-    Fetch and filter cryptocurrencies based on specified parameters.
+    # Thinly traded coins have null price/market cap/volume
+    if (coin.get("current_price") is None or coin.get("market_cap") is None
+            or coin.get("total_volume") is None):
+        return None
+    if not (min_price <= coin["current_price"] <= max_price
+            and coin["market_cap"] >= MIN_MARKET_CAP
+            and coin["total_volume"] >= MIN_VOLUME):
+        return None
+    return {
+        "id": coin["id"],
+        "symbol": coin["symbol"],
+        "name": coin["name"],
+        "current_price": coin["current_price"],
+        "market_cap": coin["market_cap"],
+        "total_volume": coin["total_volume"],
+        "price_change_percentage_24h": coin.get("price_change_percentage_24h", 0),
+        "timestamp": fetched_at
+    }
+
+
+async def fetch_market_page(page: int, min_price: float, max_price: float,
+                            session: Optional[aiohttp.ClientSession] = None
+                            ) -> Tuple[int, Optional[List[Dict]], List[Dict]]:
     """
+    Streams one /coins/markets page, filtering each coin as it is decoded.
+    Returns (page, coins listed, matching documents); listed is None if the request failed.
+    """
+    url = f"{COINGECKO_API_URL}/coins/markets"
+    params = {
+        "vs_currency": "usd",
+        "price_change_percentage": "24h",
+        "order": "market_cap_desc",
+        "per_page": MARKET_PAGE_SIZE,
+        "page": page
+    }
+    listed: List[Dict] = []
+    matching: List[Dict] = []
+    fetched_at = datetime.now(timezone.utc)
     try:
-        url = "https://api.coingecko.com/api/v3/coins/markets"
-        params = {
-            "vs_currency": "usd",
-            "price_change_percentage": "24h",
-            "order": "market_cap_desc",
-            "per_page": 250,
-            "page": 1
-        }
-
-        # Fetching the coins data
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-
-                    # Filter cryptocurrencies based on criteria
-                    filtered_coins = [
-                        {
-                            "id": coin["id"],
-                            "symbol": coin["symbol"],
-                            "name": coin["name"],
-                            "current_price": coin["current_price"],
-                            "market_cap": coin["market_cap"],
-                            "total_volume": coin["total_volume"],
-                            "price_change_percentage_24h": coin.get("price_change_percentage_24h", 0),
-                            "timestamp": datetime.now(timezone.utc)
-                        }
-                        for coin in data
-                        if min_price <= coin["current_price"] <= max_price
-                        and coin["market_cap"] >= MIN_MARKET_CAP
-                        and coin["total_volume"] >= MIN_VOLUME
-                    ]
-
-                    logger.info(
-                        f"Filtered coins: {len(filtered_coins)} coins meet the criteria.")
-                    return filtered_coins
-                else:
-                    logger.error(
-                        f"Failed to fetch currencies. Status: {response.status}")
+        # A 304 replays the cached coins
+        async with aclosing(iter_json(url, params=params, session=session)) as coins:
+            async for coin in coins:
+                listed.append({"id": coin["id"], "symbol": coin.get("symbol"),
+                               "market_cap": coin.get("market_cap"),
+                               "total_volume": coin.get("total_volume")})
+                with phase("validate"):
+                    document = market_document(coin, min_price, max_price, fetched_at)
+                if document is not None:
+                    matching.append(document)
+    except aiohttp.ClientResponseError as e:
+        note_error(e)
+        logger.error(f"Failed to fetch market page {page}. Status: {e.status}")
+        return page, None, []
+    except DeadlineExceeded:
+        logger.warning(f"Market page {page} wasn't fetched before the deadline.")
+        return page, None, []
+    except Exception as e:
+        note_error(e)
+        logger.error(f"Error fetching market page {page}: {e!r}")
+        return page, None, []
+    count("read", len(listed))
+    return page, listed, matching
+
+
+async def iter_market_pages(min_price: float, max_price: float,
+                            session: Optional[aiohttp.ClientSession] = None,
+                            max_pages: int = MARKET_MAX_PAGES,
+                            concurrency: int = MARKET_FETCH_CONCURRENCY
+                            ) -> AsyncIterator[Tuple[int, Optional[List[Dict]], List[Dict]]]:
+    """
+    Yields (page, coins listed, matching documents) for the whole /coins/markets listing in
+    completion order, keeping `concurrency` pages in flight. A page that failed is
+    yielded with listed None and marks the run partial. Paging stops at the first
+    short page, or at the job's deadline with the run marked partial.
+    """
+    pending = set()
+    next_page = 1
+    last_page = max_pages
+
+    def schedule():
+        nonlocal next_page
+        while len(pending) < concurrency and next_page <= last_page:
+            pending.add(asyncio.create_task(
+                fetch_market_page(next_page, min_price, max_price, session)))
+            next_page += 1
+
+    schedule()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, timeout=remaining_budget(),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                pending.discard(task)
+                page, listed, matching = task.result()
+                if listed is None:
+                    run = current_run()
+                    if run is not None:
+                        run.mark_partial(f"market page {page} not fetched")
+                    yield page, None, []
+                    continue
+                if len(listed) < MARKET_PAGE_SIZE:
+                    last_page = min(last_page, page)
+                if listed:
+                    yield page, listed, matching
+            if deadline_passed():
+                run = current_run()
+                if run is not None and (pending or next_page <= last_page):
+                    run.mark_partial("market listing cut off by the deadline")
+                return
+            schedule()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def filter_currencies_based_on_params(min_price: float, max_price: float,
+                                            session: Optional[aiohttp.ClientSession] = None) -> List[Dict]:
+    """
+    Fetch and filter cryptocurrencies based on specified parameters, across the
+    whole /coins/markets listing. Coins are filtered as they are decoded.
+    Also refreshes market_universe for fetch_prices; a listing with failed pages
+    or cut off by the deadline only adds to it, so no coin drops out for a tick.
+    """
+    global market_universe
+    filtered_coins: List[Dict] = []
+    listed_by_page: Dict[int, List[Dict]] = {}
+    failed_pages: List[int] = []
+    try:
+        async for page, listed, matching in iter_market_pages(min_price, max_price, session):
+            if listed is None:
+                failed_pages.append(page)
+                continue
+            listed_by_page[page] = listed
+            filtered_coins.extend(matching)
+
+        listing = {coin.pop("id"): coin for page in sorted(listed_by_page)
+                   for coin in listed_by_page[page]}
+        if failed_pages or deadline_passed():
+            market_universe = {**market_universe, **listing}
+        elif listing:
+            market_universe = listing
+        logger.info(
+            f"Filtered coins: {len(filtered_coins)} of {sum(map(len, listed_by_page.values()))} "
+            f"coins meet the criteria.")
     except Exception as e:
+        note_error(e)
         logger.exception("Error in filter_currencies_based_on_params")
-    return []
+    return filtered_coins
 
 # Store filtered cryptocurrencies in MongoDB
 
 
-async def store_filtered_currencies(currencies: List[Dict], collection: Collection):
+async def store_filtered_currencies(currencies: List[Dict]):
     """
     Store filtered cryptocurrencies in MongoDB.
     """
@@ -339,21 +656,10 @@ async def store_filtered_currencies(currencies: List[Dict], collection: Collecti
             logger.warning("No filtered currencies provided.")
             return
 
-        # Bulk upsert operation for efficient updates
-        operations = [
-            {
-                "updateOne": {
-                    "filter": {"id": currency["id"]},
-                    "update": {"$set": currency},
-                    "upsert": True
-                }
-            }
-            for currency in currencies
-        ]
-
-        if operations:
-            result = await collection.bulk_write(operations)
-            logger.info(f"Filtered currencies stored successfully. "
-                        f"Matched: {result.matched_count}, Upserted: {result.upserted_count}.")
+        # Queue the changed coins; the write buffer sends them in bulk
+        currencies = await queue_changed(MarketRepository(), "id", currencies)
+        logger.info(
+            f"Filtered currencies queued for storing: {len(currencies)} coins.")
     except Exception as e:
+        note_error(e)
         logger.exception("Failed to store filtered currencies")
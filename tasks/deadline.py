@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# How long one run of a job may take, so it ends well within its 10 minute interval
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "540"))
+# Time a job gets after its deadline to store what it has before it is cancelled
+JOB_CANCEL_GRACE_SECONDS = float(os.getenv("JOB_CANCEL_GRACE_SECONDS", "15"))
+
+COMPLETED = "completed"
+PARTIAL = "partial"
+TIMED_OUT = "timed_out"
+FAILED = "failed"
+# Cancelled from outside before it finished, e.g. by the scheduler shutting down
+CANCELLED = "cancelled"
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised instead of starting work after the current job's deadline has passed.
+    """
+
+
+class JobRun:
+    """
+    One run of a scheduled job: its deadline, and whether it got through all its
+    work. Code running inside the job reads it through current_run().
+    """
+
+    def __init__(self, job_id: str, budget: float):
+        self.job_id = job_id
+        self._loop = asyncio.get_running_loop()
+        self.started_at = self._loop.time()
+        self.ends_at = self.started_at + budget
+        self.status = COMPLETED
+        self.partial_reasons: List[str] = []
+        self.error: Optional[BaseException] = None
+        # Filled in by tasks.pipeline (stage outcomes) and tasks.run_metrics (stage costs)
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.metrics: Dict[str, Dict[str, Any]] = {}
+
+    def remaining(self) -> float:
+        return max(0.0, self.ends_at - self._loop.time())
+
+    def elapsed(self) -> float:
+        return self._loop.time() - self.started_at
+
+    def mark_partial(self, reason: str) -> None:
+        """
+        Records that some of the run's work was left out, e.g. cut off by the deadline.
+        """
+        logger.warning(f"{self.job_id} is partial: {reason}")
+        self.partial_reasons.append(reason)
+        if self.status == COMPLETED:
+            self.status = PARTIAL
+
+
+_current_run: ContextVar[Optional[JobRun]] = ContextVar("job_run", default=None)
+
+
+def current_run() -> Optional[JobRun]:
+    """
+    Returns the run of the job this code executes in, or None outside the scheduler.
+    """
+    return _current_run.get()
+
+
+def deadline_passed() -> bool:
+    """
+    Whether the current job, if any, is past its deadline.
+    """
+    run = _current_run.get()
+    return run is not None and run.remaining() <= 0
+
+
+def remaining_budget() -> Optional[float]:
+    """
+    Seconds left before the current job's deadline, or None when there is no deadline.
+    """
+    run = _current_run.get()
+    return None if run is None else run.remaining()
+
+
+@contextmanager
+def job_run(job_id: str, budget: float = JOB_DEADLINE_SECONDS) -> Iterator[JobRun]:
+    """
+    Makes a JobRun current for the block and the tasks it creates.
+    """
+    run = JobRun(job_id, budget)
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        _current_run.reset(token)
+
+
+async def gather_until_deadline(*aws: Awaitable, what: str = "tasks") -> List[Any]:
+    """
+    Like asyncio.gather(..., return_exceptions=True), but stops waiting at the
+    current job's deadline: unfinished awaitables are cancelled and come back as
+    DeadlineExceeded, and the run is marked partial.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    if not tasks:
+        return []
+    try:
+        _, pending = await asyncio.wait(tasks, timeout=remaining_budget())
+    finally:
+        for task in tasks:
+            task.cancel()
+    if pending:
+        # Let the cancelled ones release their connections before returning
+        await asyncio.wait(pending)
+
+    results: List[Any] = []
+    for task in tasks:
+        if task in pending:
+            if not task.cancelled():
+                # Retrieved so it isn't logged as unhandled; the deadline is what matters
+                task.exception()
+            results.append(DeadlineExceeded())
+        elif task.cancelled():
+            results.append(asyncio.CancelledError())
+        else:
+            results.append(task.exception() or task.result())
+    # Requests time out with the deadline, so some finish just before it with DeadlineExceeded
+    cut_off = sum(isinstance(result, DeadlineExceeded) for result in results)
+    if cut_off and _current_run.get() is not None:
+        _current_run.get().mark_partial(
+            f"{cut_off} of {len(tasks)} {what} cut off by the deadline")
+    return results
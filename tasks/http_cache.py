@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from tasks.http_session import upstream_request
+from tasks.json_decode import iter_json_items, read_json
+
+logger = logging.getLogger(__name__)
+
+# Responses younger than this are served without asking the upstream at all
+HTTP_CACHE_FRESH_SECONDS = float(os.getenv("HTTP_CACHE_FRESH_SECONDS", "0"))
+# Entries older than this are dropped instead of revalidated
+HTTP_CACHE_TTL_SECONDS = float(os.getenv("HTTP_CACHE_TTL_SECONDS", "3600"))
+# Number of URL+params entries kept in memory
+HTTP_CACHE_MAX_ENTRIES = int(os.getenv("HTTP_CACHE_MAX_ENTRIES", "500"))
+# Optional JSON file the cache is loaded from on startup and saved to on shutdown
+HTTP_CACHE_PATH = os.getenv("HTTP_CACHE_PATH")
+
+
+def _validators(entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    headers = {}
+    if entry is not None:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def cache_key(url: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Builds a key from the URL and its query parameters, independent of their order.
+    """
+    if not params:
+        return url
+    query = "&".join(f"{name}={params[name]}" for name in sorted(params))
+    return f"{url}?{query}"
+
+
+class ResponseCache:
+    """
+    LRU of parsed JSON responses with their ETag/Last-Modified validators, used
+    to send conditional requests and reuse the cached payload on a 304.
+    """
+
+    def __init__(self, max_entries: int = HTTP_CACHE_MAX_ENTRIES,
+                 ttl: float = HTTP_CACHE_TTL_SECONDS,
+                 fresh_for: float = HTTP_CACHE_FRESH_SECONDS,
+                 path: Optional[str] = HTTP_CACHE_PATH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fresh_for = fresh_for
+        self.path = path
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.stats = {"fresh_hits": 0, "not_modified": 0, "misses": 0}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["stored_at"] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, payload: Any, etag: Optional[str],
+            last_modified: Optional[str]) -> None:
+        self._entries[key] = {"payload": payload, "etag": etag,
+                              "last_modified": last_modified, "stored_at": time.time()}
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def touch(self, key: str) -> None:
+        """
+        Marks an entry as just revalidated.
+        """
+        self._entries[key]["stored_at"] = time.time()
+
+    def load(self) -> None:
+        """
+        Restores entries persisted by save(), if a cache file is configured.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load HTTP cache from {self.path}: {e}")
+            return
+        for key, entry in entries.items():
+            self._entries[key] = entry
+        # Expired entries are dropped lazily by get()
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        logger.info(f"Loaded {len(self._entries)} cached responses from {self.path}")
+
+    def save(self) -> None:
+        """
+        Writes the entries to the cache file, if one is configured.
+        """
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError) as e:
+            logger.warning(f"Could not save HTTP cache to {self.path}: {e}")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {**self.stats, "entries": len(self._entries)}
+
+
+async def get_json(url: str, params: Optional[Dict[str, Any]] = None,
+                   session: Optional[aiohttp.ClientSession] = None,
+                   cache: Optional[ResponseCache] = None) -> Tuple[int, Any]:
+    """
+    GETs a JSON resource with If-None-Match/If-Modified-Since from the cached
+    validators. Returns (status, payload); a 304 is returned as (200, cached payload),
+    and any other non-200 status as (status, None).
+    """
+    cache = cache or response_cache
+    key = cache_key(url, params)
+    entry = cache.get(key)
+    if entry is not None and time.time() - entry["stored_at"] < cache.fresh_for:
+        cache.stats["fresh_hits"] += 1
+        return 200, entry["payload"]
+
+    async with upstream_request("GET", url, session=session, params=params,
+                                headers=_validators(entry)) as response:
+        if response.status == 304 and entry is not None:
+            cache.stats["not_modified"] += 1
+            cache.touch(key)
+            return 200, entry["payload"]
+        if response.status != 200:
+            return response.status, None
+
+        cache.stats["misses"] += 1
+        payload = await read_json(response)
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified or cache.fresh_for:
+            cache.put(key, payload, etag, last_modified)
+        return 200, payload
+
+
+async def iter_json(url: str, prefix: str = "item", params: Optional[Dict[str, Any]] = None,
+                    session: Optional[aiohttp.ClientSession] = None,
+                    cache: Optional[ResponseCache] = None) -> AsyncIterator[Any]:
+    """
+    Like get_json(), but yields the items of the array at `prefix` as they are
+    decoded from the response stream. A 304 replays the cached items. Any other
+    non-200 status raises aiohttp.ClientResponseError.
+    """
+    cache = cache or response_cache
+    key = cache_key(url, params)
+    entry = cache.get(key)
+    if entry is not None and time.time() - entry["stored_at"] < cache.fresh_for:
+        cache.stats["fresh_hits"] += 1
+        for item in entry["payload"]:
+            yield item
+        return
+
+    async with upstream_request("GET", url, session=session, params=params,
+                                headers=_validators(entry)) as response:
+        if response.status == 304 and entry is not None:
+            cache.stats["not_modified"] += 1
+            cache.touch(key)
+            for item in entry["payload"]:
+                yield item
+            return
+        if response.status != 200:
+            raise aiohttp.ClientResponseError(
+                response.request_info, response.history, status=response.status,
+                message="Unexpected upstream status", headers=response.headers)
+
+        cache.stats["misses"] += 1
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        # Keep the decoded items only if the response can be revalidated or reused later
+        kept: Optional[List[Any]] = [] if (etag or last_modified or cache.fresh_for) else None
+        async for item in iter_json_items(response, prefix):
+            if kept is not None:
+                kept.append(item)
+            yield item
+        # Only a fully consumed response is cached
+        if kept is not None:
+            cache.put(key, kept, etag, last_modified)
+
+
+# Shared by the CoinGecko fetchers; loaded and saved with the HTTP session's lifecycle
+response_cache = ResponseCache()
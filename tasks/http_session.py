@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiohttp
+from yarl import URL
+
+from tasks.circuit_breaker import circuit_breakers
+from tasks.deadline import DeadlineExceeded, deadline_passed, remaining_budget
+from tasks.run_metrics import record_upstream
+from tasks.rate_limit import (
+    HTTP_MAX_RETRIES,
+    RETRY_STATUSES,
+    backoff_delay,
+    rate_limiter,
+)
+
+logger = logging.getLogger(__name__)
+
+# Connector settings for the shared upstream session
+HTTP_CONNECTION_LIMIT = int(os.getenv("HTTP_CONNECTION_LIMIT", "100"))
+HTTP_CONNECTION_LIMIT_PER_HOST = int(
+    os.getenv("HTTP_CONNECTION_LIMIT_PER_HOST", "10"))
+HTTP_DNS_CACHE_TTL_SECONDS = int(os.getenv("HTTP_DNS_CACHE_TTL_SECONDS", "300"))
+HTTP_KEEPALIVE_TIMEOUT_SECONDS = float(
+    os.getenv("HTTP_KEEPALIVE_TIMEOUT_SECONDS", "60"))
+# Default request timeouts, instead of aiohttp's 5 minute total
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "30"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+# Longest wait for the next chunk of a response body
+HTTP_READ_TIMEOUT_SECONDS = float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "20"))
+
+# Per-host request and connection reuse counters, filled in by trace callbacks
+session_stats: Dict[str, Dict[str, int]] = {}
+
+# Process-wide session, created once by init_session()
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _host_stats(trace_config_ctx: SimpleNamespace) -> Dict[str, int]:
+    host = getattr(trace_config_ctx, "host", "unknown")
+    stats = session_stats.get(host)
+    if stats is None:
+        stats = {"requests": 0, "errors": 0, "new_connections": 0, "reused_connections": 0,
+                 "dns_cache_hits": 0, "dns_cache_misses": 0}
+        session_stats[host] = stats
+    return stats
+
+
+async def _on_request_start(session, trace_config_ctx, params):
+    # The same context object is passed to every callback of this request
+    trace_config_ctx.host = params.url.host
+    _host_stats(trace_config_ctx)["requests"] += 1
+
+
+async def _on_request_exception(session, trace_config_ctx, params):
+    _host_stats(trace_config_ctx)["errors"] += 1
+
+
+async def _on_connection_create_end(session, trace_config_ctx, params):
+    _host_stats(trace_config_ctx)["new_connections"] += 1
+
+
+async def _on_connection_reuseconn(session, trace_config_ctx, params):
+    _host_stats(trace_config_ctx)["reused_connections"] += 1
+
+
+async def _on_dns_cache_hit(session, trace_config_ctx, params):
+    _host_stats(trace_config_ctx)["dns_cache_hits"] += 1
+
+
+async def _on_dns_cache_miss(session, trace_config_ctx, params):
+    _host_stats(trace_config_ctx)["dns_cache_misses"] += 1
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_request_exception.append(_on_request_exception)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    trace_config.on_dns_cache_hit.append(_on_dns_cache_hit)
+    trace_config.on_dns_cache_miss.append(_on_dns_cache_miss)
+    return trace_config
+
+
+def init_session() -> aiohttp.ClientSession:
+    """
+    Creates the shared ClientSession on the running event loop. Calling it again
+    returns the existing session.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_CONNECTION_LIMIT,
+        limit_per_host=HTTP_CONNECTION_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL_SECONDS,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT_SECONDS,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS,
+        sock_read=HTTP_READ_TIMEOUT_SECONDS)
+    _session = aiohttp.ClientSession(
+        connector=connector, timeout=timeout, trace_configs=[_trace_config()])
+    return _session
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Returns the shared session, creating it lazily for standalone scripts.
+    """
+    if _session is None or _session.closed:
+        return init_session()
+    return _session
+
+
+async def close_session() -> None:
+    """
+    Closes the shared session and its pooled connections.
+    """
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+def request_timeout() -> Optional[aiohttp.ClientTimeout]:
+    """
+    Returns the default timeouts cut down to what is left of the current job's
+    deadline, or None (the session's defaults) outside a job. Raises
+    DeadlineExceeded once nothing is left.
+    """
+    budget = remaining_budget()
+    if budget is None:
+        return None
+    if budget <= 0:
+        raise DeadlineExceeded("Job deadline passed before the request was sent")
+    return aiohttp.ClientTimeout(
+        total=min(HTTP_TIMEOUT_SECONDS, budget),
+        connect=min(HTTP_CONNECT_TIMEOUT_SECONDS, budget),
+        sock_read=min(HTTP_READ_TIMEOUT_SECONDS, budget))
+
+
+@asynccontextmanager
+async def upstream_request(method: str, url: str,
+                           session: Optional[aiohttp.ClientSession] = None,
+                           max_retries: int = HTTP_MAX_RETRIES,
+                           **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+    """
+    Sends a request through the host's circuit breaker and rate limiter and yields
+    the response. 429/5xx responses and connection errors are retried with jittered
+    exponential backoff; the last response is yielded as-is once retries run out.
+    Raises CircuitOpenError without sending anything while the host's breaker is open.
+    Inside a job, timeouts shrink to the job's remaining budget and no retry is
+    waited for past its deadline.
+    """
+    session = session or get_session()
+    host = URL(url).host
+    breaker = circuit_breakers.breaker(host)
+    caller_timeout = kwargs.pop("timeout", None)
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            await rate_limiter.acquire(host)
+            timeout = caller_timeout or request_timeout()
+            if timeout is not None:
+                kwargs["timeout"] = timeout
+            started = time.monotonic()
+            response = await session.request(method, url, **kwargs)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if deadline_passed():
+                # Cut off by the job's deadline, not the upstream's fault
+                breaker.abandon()
+                raise DeadlineExceeded(f"Job deadline passed during {method} {host}") from e
+            breaker.record(False, time.monotonic() - started)
+            record_upstream(host, time.monotonic() - started)
+            delay = backoff_delay(attempt)
+            if attempt >= max_retries or not _retry_fits(delay):
+                raise
+            logger.warning(f"{method} {host} failed ({e!r}), retrying in {delay:.1f}s")
+        except BaseException:
+            breaker.abandon()
+            raise
+        else:
+            breaker.record(response.status < 500, time.monotonic() - started)
+            record_upstream(host, time.monotonic() - started)
+            retry_after = rate_limiter.observe(host, response.status, response.headers)
+            delay = backoff_delay(attempt, retry_after)
+            if (response.status not in RETRY_STATUSES or attempt >= max_retries
+                    or not _retry_fits(delay)):
+                try:
+                    yield response
+                finally:
+                    response.release()
+                return
+            response.release()
+            logger.warning(
+                f"{method} {host} returned {response.status}, retrying in {delay:.1f}s")
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def _retry_fits(delay: float) -> bool:
+    """
+    Whether a retry after `delay` seconds would still start before the job's deadline.
+    """
+    budget = remaining_budget()
+    return budget is None or delay < budget
+
+
+def connection_stats() -> Dict[str, Any]:
+    """
+    Returns per-host request counts, how often a pooled connection was reused,
+    and the rate limiter's queue times.
+    """
+    hosts = {}
+    for host, stats in session_stats.items():
+        opened = stats["new_connections"] + stats["reused_connections"]
+        hosts[host] = {**stats,
+                       "reuse_ratio": stats["reused_connections"] / opened if opened else None}
+    return {"open": _session is not None and not _session.closed, "hosts": hosts,
+            "rate_limits": rate_limiter.stats()}
@@ -0,0 +1,75 @@
+import json
+import os
+import time
+from typing import Any, AsyncIterator
+
+import aiohttp
+
+from tasks.run_metrics import add_time, phase
+
+# orjson decodes straight from bytes, about twice as fast as the stdlib decoder
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ijson decodes array items one at a time from the response stream
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Bodies at least this large (or of unknown length) are decoded item by item; smaller
+# ones are decoded whole with loads(), which is faster but holds the full body in memory
+JSON_STREAM_MIN_BYTES = int(os.getenv("JSON_STREAM_MIN_BYTES", str(1024 * 1024)))
+
+
+def loads(data: bytes) -> Any:
+    """
+    Decodes a JSON document from raw bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+async def read_json(response: aiohttp.ClientResponse) -> Any:
+    """
+    Reads and decodes a whole response body without aiohttp's intermediate str copy.
+    """
+    with phase("fetch"):
+        body = await response.read()
+    with phase("parse"):
+        return loads(body)
+
+
+async def iter_json_items(response: aiohttp.ClientResponse,
+                          prefix: str = "item") -> AsyncIterator[Any]:
+    """
+    Yields the items of the array at `prefix` (ijson syntax; "item" is a top-level
+    array). Large bodies are decoded as they stream in, without buffering them;
+    small ones, or all of them when ijson isn't installed, are decoded whole.
+    """
+    length = response.content_length
+    if ijson is not None and (length is None or length >= JSON_STREAM_MIN_BYTES):
+        items = ijson.items(response.content, prefix, use_float=True).__aiter__()
+        # Streamed bodies are read while decoding, so both count as parsing
+        parsing = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = await items.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    parsing += time.perf_counter() - started
+                yield item
+        finally:
+            add_time("parse", parsing)
+
+    payload = await read_json(response)
+    for key in prefix.split(".")[:-1]:
+        payload = payload[key]
+    for item in payload:
+        yield item
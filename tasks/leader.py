@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from db.repositories import LeaseRepository
+
+logger = logging.getLogger(__name__)
+
+# Off: every process runs the scheduler, as before (single-worker development)
+LEADER_ELECTION_ENABLED = os.getenv("LEADER_ELECTION_ENABLED", "true").lower() == "true"
+# A leader that stops renewing loses the lease this long after its last heartbeat
+LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "15"))
+# How often the leader renews the lease and the other processes try to take it
+LEADER_HEARTBEAT_SECONDS = float(os.getenv("LEADER_HEARTBEAT_SECONDS", "5"))
+
+SCHEDULER_LEASE = "scheduler"
+
+
+class LeaderElector:
+    """
+    Holds a MongoDB lease so only one process across all workers and nodes is
+    leader. Every process tries to take or renew the lease each heartbeat; the
+    leader steps down as soon as the lease is taken over, or once it has gone a
+    full lease without a successful renewal. A stopped leader releases the lease
+    so another process takes over on its next heartbeat.
+    """
+
+    def __init__(self, lease_name: str, lease_seconds: float = LEADER_LEASE_SECONDS,
+                 heartbeat_seconds: float = LEADER_HEARTBEAT_SECONDS):
+        self.lease_name = lease_name
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.term: Optional[int] = None
+        # Monotonic time until which the last successful renewal guarantees the lease
+        self.valid_until = 0.0
+        self.stats = {"elected": 0, "demoted": 0, "heartbeat_errors": 0}
+        self._on_elected: Optional[Callable[[], Awaitable[None]]] = None
+        self._on_demoted: Optional[Callable[[], Awaitable[None]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._callback: Optional[asyncio.Task] = None
+
+    def _notify(self, callback: Optional[Callable[[], Awaitable[None]]], leader: bool) -> None:
+        """
+        Runs a role change callback in its own task, so a slow one (seeding the
+        change detector on election) doesn't hold up renewing the lease. Callbacks
+        run one at a time in order; one whose role has changed again by the time
+        it would start is skipped.
+        """
+        previous = self._callback
+
+        async def run() -> None:
+            if previous is not None:
+                await asyncio.wait([previous])
+            if callback is None or self.is_leader != leader:
+                return
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"Error handling lease change for '{self.lease_name}': {e}")
+
+        self._callback = asyncio.create_task(run())
+
+    def _elect(self) -> None:
+        self.is_leader = True
+        self.stats["elected"] += 1
+        logger.info(f"{self.holder} is now leader for '{self.lease_name}' (term {self.term})")
+        self._notify(self._on_elected, leader=True)
+
+    def _demote(self, reason: str) -> None:
+        self.is_leader = False
+        self.stats["demoted"] += 1
+        logger.warning(f"{self.holder} is no longer leader for '{self.lease_name}': {reason}")
+        self._notify(self._on_demoted, leader=False)
+
+    async def heartbeat(self) -> None:
+        """
+        Takes or renews the lease once, switching roles if that changed.
+        """
+        started = time.monotonic()
+        try:
+            lease = await LeaseRepository().try_acquire(
+                self.lease_name, self.holder, self.lease_seconds)
+        except Exception as e:
+            self.stats["heartbeat_errors"] += 1
+            logger.warning(f"Lease heartbeat for '{self.lease_name}' failed: {e}")
+            if self.is_leader and time.monotonic() >= self.valid_until:
+                self._demote("lease expired without a successful renewal")
+            return
+
+        if lease is None:
+            if self.is_leader:
+                self._demote("lease taken over")
+            return
+        self.valid_until = started + self.lease_seconds
+        self.term = lease.get("term")
+        if not self.is_leader:
+            self._elect()
+
+    async def _heartbeat_forever(self) -> None:
+        while True:
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error(f"Lease heartbeat for '{self.lease_name}' failed: {e}")
+            await asyncio.sleep(self.heartbeat_seconds)
+
+    def start(self, on_elected: Optional[Callable[[], Awaitable[None]]] = None,
+              on_demoted: Optional[Callable[[], Awaitable[None]]] = None) -> None:
+        """
+        Starts heartbeating on the running event loop.
+        """
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._heartbeat_forever())
+
+    async def stop(self) -> None:
+        """
+        Stops heartbeating and releases the lease if this process holds it.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._callback is not None:
+            self._callback.cancel()
+            self._callback = None
+
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await LeaseRepository().release(self.lease_name, self.holder)
+                logger.info(f"{self.holder} released the '{self.lease_name}' lease")
+            except Exception as e:
+                logger.warning(f"Could not release the '{self.lease_name}' lease: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "holder": self.holder,
+            "is_leader": self.is_leader,
+            "term": self.term,
+            "lease_seconds": self.lease_seconds,
+            "heartbeat_seconds": self.heartbeat_seconds,
+            **self.stats,
+        }
+
+
+# Decides which process runs the scheduler's jobs; see tasks.scheduler.init_scheduler()
+scheduler_leader = LeaderElector(SCHEDULER_LEASE)
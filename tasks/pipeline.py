@@ -0,0 +1,147 @@
+import asyncio
+import contextlib
+import logging
+import random
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from tasks.circuit_breaker import circuit_breakers
+from tasks.deadline import current_run, remaining_budget
+from tasks.run_metrics import stage_scope
+
+logger = logging.getLogger(__name__)
+
+OK = "ok"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class Stage:
+    """
+    One step of a tick. `func` is awaited with the results of the stages it
+    `needs`, mapped to keyword arguments ({argument: stage name}), plus `kwargs`.
+    It starts once those stages and the ones it runs `after` have finished, but
+    no earlier than `offset` plus up to `jitter` seconds into the tick, and is
+    skipped when a needed stage produced nothing or one of its `upstreams`
+    (hosts) has an open circuit.
+    """
+
+    def __init__(self, name: str, func: Callable, needs: Optional[Dict[str, str]] = None,
+                 after: Iterable[str] = (), upstreams: Iterable[str] = (),
+                 offset: float = 0, jitter: float = 0, **kwargs):
+        self.name = name
+        self.func = func
+        self.needs = dict(needs or {})
+        self.after = list(after)
+        self.upstreams = list(upstreams)
+        self.offset = offset
+        self.jitter = jitter
+        self.kwargs = kwargs
+
+    def depends_on(self) -> List[str]:
+        return list(self.needs.values()) + self.after
+
+
+class TickGraph:
+    """
+    Stages run concurrently as soon as their dependencies and start offsets allow,
+    at most `max_concurrency` at a time, so every upstream is fetched once per
+    tick and its parsed result handed to each stage that needs it.
+    """
+
+    def __init__(self, stages: List[Stage], max_concurrency: Optional[int] = None):
+        self._slots = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("Stage names must be unique")
+        for stage in stages:
+            unknown = [name for name in stage.depends_on() if name not in self.stages]
+            if unknown:
+                raise ValueError(f"Stage {stage.name} depends on unknown stages {unknown}")
+        self._check_acyclic()
+
+    def _check_acyclic(self) -> None:
+        done = set()
+        visiting = set()
+
+        def visit(name: str) -> None:
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage {name} depends on itself")
+            visiting.add(name)
+            for dependency in self.stages[name].depends_on():
+                visit(dependency)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    async def run(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Runs one tick and returns a report per stage: its status (ok, failed or
+        skipped), duration, how long it waited to start once ready, and error or skip
+        reason. The report is also kept on the current job run, and failed and
+        skipped stages mark it partial.
+        """
+        loop = asyncio.get_running_loop()
+        tick_started = loop.time()
+        results: Dict[str, Any] = {}
+        report: Dict[str, Dict[str, Any]] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+
+        def skip(stage: Stage, reason: str) -> None:
+            logger.info(f"Skipping stage {stage.name}: {reason}")
+            report[stage.name] = {"status": SKIPPED, "reason": reason}
+
+        async def run_stage(stage: Stage) -> None:
+            planned = tick_started + stage.offset + random.uniform(0, stage.jitter)
+            dependencies = stage.depends_on()
+            if dependencies:
+                await asyncio.wait([tasks[name] for name in dependencies])
+
+            for argument, name in stage.needs.items():
+                if report[name]["status"] != OK or results.get(name) is None:
+                    return skip(stage, f"{name} produced nothing")
+            breaker = circuit_breakers.first_unavailable(stage.upstreams)
+            if breaker is not None:
+                return skip(stage, f"circuit for {breaker.host} is {breaker.state}")
+
+            # Ready once its dependencies are done and its start offset has come
+            ready = max(planned, loop.time())
+            delay = planned - loop.time()
+            if delay > 0:
+                budget = remaining_budget()
+                if budget is not None and delay >= budget:
+                    return skip(stage, "the deadline passes before its start offset")
+                await asyncio.sleep(delay)
+
+            arguments = {argument: results[name] for argument, name in stage.needs.items()}
+            async with self._slots or contextlib.nullcontext():
+                started = loop.time()
+                try:
+                    with stage_scope(stage.name):
+                        results[stage.name] = await stage.func(**arguments, **stage.kwargs)
+                    report[stage.name] = {"status": OK}
+                except Exception as e:
+                    logger.exception(f"Stage {stage.name} failed")
+                    report[stage.name] = {"status": FAILED, "error": repr(e),
+                                          "error_class": type(e).__name__}
+            report[stage.name]["lag_seconds"] = started - ready
+            report[stage.name]["duration_seconds"] = loop.time() - started
+
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.create_task(run_stage(stage))
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+        run = current_run()
+        if run is not None:
+            run.stages.update(report)
+            for name, stage_report in report.items():
+                if stage_report["status"] != OK:
+                    run.mark_partial(f"stage {name} {stage_report['status']}")
+        return report
@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import os
+import statistics
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+from yarl import URL
+
+from db.monitoring import percentile
+from tasks.circuit_breaker import circuit_breakers
+from tasks.deadline import remaining_budget
+from tasks.http_cache import get_json
+from tasks.http_session import upstream_request
+from tasks.json_decode import read_json
+
+logger = logging.getLogger(__name__)
+
+# Sources in the order they are asked; later ones are hedges
+PRICE_SOURCES = [name.strip() for name in os.getenv(
+    "PRICE_SOURCES", "coingecko,binance,okx").split(",") if name.strip()]
+# Number of sources that must quote a coin before its consensus is taken
+PRICE_QUORUM = int(os.getenv("PRICE_QUORUM", "1"))
+# Hedge budget used until a source has enough latency samples for its own p95
+PRICE_HEDGE_DEFAULT_SECONDS = float(os.getenv("PRICE_HEDGE_DEFAULT_SECONDS", "2"))
+# Sources that haven't answered by then are left out of the consensus
+PRICE_DEADLINE_SECONDS = float(os.getenv("PRICE_DEADLINE_SECONDS", "10"))
+
+BINANCE_API_URL = os.getenv("BINANCE_API_URL", "https://api.binance.com")
+OKX_API_URL = os.getenv("OKX_API_URL", "https://www.okx.com")
+# Exchanges return every ticker in one response; it is reused for this long
+EXCHANGE_TICKERS_TTL_SECONDS = float(os.getenv("EXCHANGE_TICKERS_TTL_SECONDS", "5"))
+
+# Number of recent response times kept per source
+LATENCY_SAMPLES = 200
+MIN_LATENCY_SAMPLES = 5
+
+
+class PricesUnavailableError(Exception):
+    """
+    Counted against the run when no price source could price any coin of a chunk.
+    """
+
+
+class PriceSource(ABC):
+    """
+    One upstream that can quote USD prices for CoinGecko coin ids.
+    """
+    name = ""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.host = URL(base_url).host
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.stats = {"asked": 0, "answered": 0, "empty": 0, "failed": 0, "hedged": 0}
+
+    def hedge_budget(self) -> float:
+        """
+        How long to wait for this source before asking the next one: its p95 latency.
+        """
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return PRICE_HEDGE_DEFAULT_SECONDS
+        return percentile(list(self.latencies), 95)
+
+    def available(self) -> bool:
+        breaker = circuit_breakers.breakers.get(self.host)
+        return breaker is None or breaker.available()
+
+    async def timed(self, call):
+        started = time.monotonic()
+        result = await call
+        self.latencies.append(time.monotonic() - started)
+        return result
+
+    @abstractmethod
+    async def fetch(self, ids: List[str], symbols: Dict[str, str],
+                    session: Optional[aiohttp.ClientSession] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns {coin_id: {"usd": price, ...}} for the ids this source can price.
+        """
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "hedge_budget_seconds": self.hedge_budget()}
+
+
+class CoinGeckoSource(PriceSource):
+    name = "coingecko"
+
+    async def fetch(self, ids, symbols, session=None):
+        params = {"ids": ",".join(ids), "vs_currencies": "usd",
+                  "include_market_cap": "true", "include_24hr_vol": "true"}
+        # Unchanged responses come back as a 304 and reuse the cached payload
+        status, data = await self.timed(
+            get_json(f"{self.base_url}/simple/price", params=params, session=session))
+        if status != 200:
+            raise RuntimeError(f"{self.name} answered {status}")
+        return {coin_id: values for coin_id, values in data.items()
+                if values.get("usd") is not None}
+
+
+class ExchangeTickerSource(PriceSource):
+    """
+    Prices coins from an exchange's all-tickers endpoint through their USDT pair,
+    taking USDT at par with USD. Coins are matched on their symbol.
+    """
+
+    def __init__(self, base_url: str):
+        super().__init__(base_url)
+        self._tickers: Dict[str, float] = {}
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @abstractmethod
+    async def fetch_tickers(self, session: Optional[aiohttp.ClientSession]) -> Dict[str, float]:
+        """
+        Returns {upper-case base symbol: last USDT price}.
+        """
+
+    async def _get(self, path: str, session: Optional[aiohttp.ClientSession],
+                   params: Optional[Dict[str, str]] = None) -> Any:
+        async with upstream_request("GET", f"{self.base_url}{path}", session=session,
+                                    params=params) as response:
+            if response.status != 200:
+                raise RuntimeError(f"{self.name} answered {response.status}")
+            return await read_json(response)
+
+    async def fetch(self, ids, symbols, session=None):
+        # Concurrent chunks of one tick share a single tickers request
+        async with self._lock:
+            if time.monotonic() - self._fetched_at > EXCHANGE_TICKERS_TTL_SECONDS:
+                self._tickers = await self.timed(self.fetch_tickers(session))
+                self._fetched_at = time.monotonic()
+        prices = {}
+        for coin_id in ids:
+            symbol = symbols.get(coin_id)
+            if symbol is not None and symbol in self._tickers:
+                prices[coin_id] = {"usd": self._tickers[symbol]}
+        return prices
+
+
+class BinanceSource(ExchangeTickerSource):
+    name = "binance"
+
+    async def fetch_tickers(self, session):
+        tickers = await self._get("/api/v3/ticker/price", session)
+        return {ticker["symbol"][:-4]: float(ticker["price"]) for ticker in tickers
+                if ticker["symbol"].endswith("USDT")}
+
+
+class OkxSource(ExchangeTickerSource):
+    name = "okx"
+
+    async def fetch_tickers(self, session):
+        payload = await self._get("/api/v5/market/tickers", session, {"instType": "SPOT"})
+        return {ticker["instId"][:-5]: float(ticker["last"]) for ticker in payload["data"]
+                if ticker["instId"].endswith("-USDT") and ticker.get("last")}
+
+
+def create_price_sources(coingecko_url: str, names: List[str] = PRICE_SOURCES) -> List[PriceSource]:
+    """
+    Builds the configured sources, in order.
+    """
+    factories = {
+        "coingecko": lambda: CoinGeckoSource(coingecko_url),
+        "binance": lambda: BinanceSource(BINANCE_API_URL),
+        "okx": lambda: OkxSource(OKX_API_URL),
+    }
+    unknown = [name for name in names if name not in factories]
+    if unknown:
+        raise ValueError(f"Unknown price sources: {unknown}")
+    return [factories[name]() for name in names]
+
+
+def exchange_symbols(universe: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Maps coin ids to the upper-case symbol exchanges list them under. When several
+    coins share a symbol, only the one with the largest market cap gets it.
+    """
+    symbols: Dict[str, str] = {}
+    taken = set()
+    ranked = sorted(universe.items(), key=lambda item: item[1].get("market_cap") or 0,
+                    reverse=True)
+    for coin_id, coin in ranked:
+        symbol = (coin.get("symbol") or "").upper()
+        if symbol and symbol not in taken:
+            taken.add(symbol)
+            symbols[coin_id] = symbol
+    return symbols
+
+
+def consensus(answers: List[Tuple[PriceSource, Dict[str, Dict[str, Any]]]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Combines the answers into {coin_id: {"usd": median, "sources": [...], ...}}.
+    Market cap and volume are kept from the first source that reported them.
+    """
+    quotes: Dict[str, Dict[str, float]] = {}
+    combined: Dict[str, Dict[str, Any]] = {}
+    for source, prices in answers:
+        for coin_id, values in prices.items():
+            quotes.setdefault(coin_id, {})[source.name] = values["usd"]
+            entry = combined.setdefault(coin_id, {})
+            for field in ("usd_market_cap", "usd_24h_vol"):
+                if values.get(field) is not None:
+                    entry.setdefault(field, values[field])
+
+    for coin_id, by_source in quotes.items():
+        combined[coin_id].update(usd=statistics.median(by_source.values()),
+                                 sources=sorted(by_source))
+    return combined
+
+
+async def fetch_consensus(ids: List[str], symbols: Dict[str, str], sources: List[PriceSource],
+                          session: Optional[aiohttp.ClientSession] = None,
+                          quorum: int = PRICE_QUORUM,
+                          deadline: float = PRICE_DEADLINE_SECONDS) -> Dict[str, Dict[str, Any]]:
+    """
+    Asks the sources in order, hedged, until every coin has `quorum` quotes. The
+    next source is asked, for the coins still short of the quorum, when the last
+    one asked goes over its p95 budget, fails, or answers without covering them.
+    Stops once every coin is covered or at the deadline and returns the median
+    price of each coin that got a quote, with the contributing sources. The
+    deadline is cut short by the job's own.
+    """
+    loop = asyncio.get_running_loop()
+    budget = remaining_budget()
+    if budget is not None:
+        deadline = min(deadline, budget)
+    ends_at = loop.time() + deadline
+    queue = list(sources)
+    running: Dict[asyncio.Task, PriceSource] = {}
+    answers: List[Tuple[PriceSource, Dict[str, Dict[str, Any]]]] = []
+    quotes = dict.fromkeys(ids, 0)
+    hedge_at: Optional[float] = None
+    last_asked: Optional[PriceSource] = None
+
+    def short() -> List[str]:
+        return [coin_id for coin_id in ids if quotes[coin_id] < quorum]
+
+    def ask_next() -> None:
+        nonlocal hedge_at, last_asked
+        while queue:
+            source = queue.pop(0)
+            # An open circuit counts as an immediate failure
+            if not source.available():
+                continue
+            source.stats["asked"] += 1
+            running[asyncio.create_task(source.fetch(short(), symbols, session))] = source
+            hedge_at = loop.time() + source.hedge_budget()
+            last_asked = source
+            return
+        hedge_at = None
+
+    for _ in range(quorum):
+        ask_next()
+
+    try:
+        while running and short():
+            now = loop.time()
+            if now >= ends_at:
+                break
+            wake_at = min(ends_at, hedge_at) if hedge_at is not None else ends_at
+            done, _ = await asyncio.wait(running, timeout=max(0.0, wake_at - now),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                source = running.pop(task)
+                try:
+                    prices = task.result()
+                except Exception as e:
+                    source.stats["failed"] += 1
+                    logger.warning(f"Price source {source.name} failed: {e!r}")
+                else:
+                    if prices:
+                        answers.append((source, prices))
+                        source.stats["answered"] += 1
+                        for coin_id in prices:
+                            if coin_id in quotes:
+                                quotes[coin_id] += 1
+                    else:
+                        source.stats["empty"] += 1
+                # Whatever it left out is asked of the next source straight away
+                if short():
+                    ask_next()
+            if short() and hedge_at is not None and loop.time() >= hedge_at:
+                # The last source asked is over its budget; hedge with the next one
+                last_asked.stats["hedged"] += 1
+                ask_next()
+    finally:
+        for task in running:
+            task.cancel()
+
+    return consensus(answers)
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from db.monitoring import percentile
+
+logger = logging.getLogger(__name__)
+
+# Steady rate (requests/second) and burst size per upstream host
+HOST_RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    # CoinGecko's free tier allows roughly 30 calls per minute
+    "api.coingecko.com": (float(os.getenv("COINGECKO_RATE_PER_SECOND", "0.5")), 3),
+    # Reddit allows 100 OAuth requests per minute per client
+    "oauth.reddit.com": (float(os.getenv("REDDIT_RATE_PER_SECOND", "1.5")), 5),
+    "www.reddit.com": (float(os.getenv("REDDIT_RATE_PER_SECOND", "1.5")), 2),
+    # Exchange ticker endpoints used as hedge price sources
+    "api.binance.com": (float(os.getenv("BINANCE_RATE_PER_SECOND", "2")), 5),
+    "www.okx.com": (float(os.getenv("OKX_RATE_PER_SECOND", "2")), 5),
+}
+DEFAULT_RATE_LIMIT = (float(os.getenv("DEFAULT_RATE_PER_SECOND", "2")), 5)
+
+# Retry policy for 429/5xx responses and connection errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE_SECONDS = float(os.getenv("HTTP_BACKOFF_BASE_SECONDS", "1"))
+HTTP_BACKOFF_MAX_SECONDS = float(os.getenv("HTTP_BACKOFF_MAX_SECONDS", "60"))
+
+# Number of recent queue waits kept per host for percentiles
+QUEUE_WAIT_SAMPLES = 1000
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """
+    Exponential backoff with full jitter, never shorter than the server's Retry-After.
+    """
+    ceiling = min(HTTP_BACKOFF_MAX_SECONDS, HTTP_BACKOFF_BASE_SECONDS * 2 ** attempt)
+    delay = random.uniform(0, ceiling)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a Retry-After header given either as seconds or as an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    Token bucket for one upstream host. The rate can be lowered temporarily from
+    quota headers, and the bucket can be paused entirely after a 429.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.adapted_until = 0.0
+        self._lock = asyncio.Lock()
+        self.waits = deque(maxlen=QUEUE_WAIT_SAMPLES)
+        self.requests = 0
+        self.throttled = 0
+
+    def _refill(self, now: float) -> None:
+        if self.adapted_until and now >= self.adapted_until:
+            # The quota window the rate was adapted for has reset
+            self.rate, self.adapted_until = self.base_rate, 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        """
+        Waits for a token and returns how long the caller was queued, in seconds.
+        Callers are served one at a time, in arrival order.
+        """
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+        waited = time.monotonic() - started
+        self.waits.append(waited)
+        self.requests += 1
+        return waited
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stops handing out tokens for `seconds`, e.g. after a 429 with Retry-After.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self.throttled += 1
+
+    def adapt(self, remaining: float, reset_seconds: float) -> None:
+        """
+        Spreads the remaining quota evenly over the time left in the window.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        if remaining <= 0:
+            self.pause(reset_seconds)
+            return
+        if reset_seconds > 0:
+            self.rate = max(0.01, min(self.base_rate, remaining / reset_seconds))
+            self.adapted_until = now + reset_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        waits = list(self.waits)
+        return {
+            "rate_per_second": self.rate,
+            "base_rate_per_second": self.base_rate,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "paused_for_seconds": max(0.0, self.paused_until - time.monotonic()),
+            "queue_wait_seconds": {
+                "p50": percentile(waits, 50),
+                "p95": percentile(waits, 95),
+                "max": max(waits) if waits else None,
+            },
+        }
+
+
+class RateLimiter:
+    """
+    One token bucket per upstream host, created on first use.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]] = HOST_RATE_LIMITS):
+        self.limits = limits
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def bucket(self, host: str) -> TokenBucket:
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            rate, burst = self.limits.get(host, DEFAULT_RATE_LIMIT)
+            bucket = TokenBucket(rate, burst)
+            self.buckets[host] = bucket
+        return bucket
+
+    async def acquire(self, host: str) -> float:
+        return await self.bucket(host).acquire()
+
+    def observe(self, host: str, status: int, headers) -> Optional[float]:
+        """
+        Adapts the host's bucket from a response's rate-limit headers. Returns the
+        Retry-After delay in seconds, if the response carried one.
+        """
+        bucket = self.bucket(host)
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+        if status == 429:
+            bucket.pause(retry_after if retry_after is not None else backoff_delay(0))
+
+        remaining = headers.get("X-Ratelimit-Remaining")
+        reset = headers.get("X-Ratelimit-Reset")
+        if remaining is not None and reset is not None:
+            try:
+                bucket.adapt(float(remaining), float(reset))
+            except ValueError:
+                logger.warning(
+                    f"Unparseable rate-limit headers from {host}: remaining={remaining}, reset={reset}")
+        return retry_after
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {host: bucket.stats() for host, bucket in self.buckets.items()}
+
+
+# Every outbound request goes through this limiter via tasks.http_session.upstream_request()
+rate_limiter = RateLimiter()
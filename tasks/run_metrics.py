@@ -0,0 +1,137 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, Optional
+
+from db.monitoring import percentile
+from tasks.deadline import JobRun, current_run
+
+# Phases a stage's time is split into. They are summed across the stage's
+# concurrent requests, so together they can exceed its wall-clock duration.
+PHASES = ("fetch", "parse", "validate", "write")
+
+# Stage of the tick graph the current code runs in; set by tasks.pipeline
+_current_stage: ContextVar[Optional[str]] = ContextVar("run_stage", default=None)
+
+
+@contextmanager
+def stage_scope(name: str) -> Iterator[None]:
+    """
+    Attributes the metrics recorded in the block to stage `name`.
+    """
+    token = _current_stage.set(name)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+
+def _metrics() -> Optional[Dict[str, Any]]:
+    run = current_run()
+    if run is None:
+        return None
+    name = _current_stage.get() or run.job_id
+    metrics = run.metrics.get(name)
+    if metrics is None:
+        metrics = {"phases": dict.fromkeys(PHASES, 0.0),
+                   "documents": {"read": 0, "written": 0, "skipped": 0},
+                   "upstream": {}, "errors": {}}
+        run.metrics[name] = metrics
+    return metrics
+
+
+def add_time(name: str, seconds: float) -> None:
+    """
+    Adds seconds to the current stage's `name` phase. Does nothing outside a job run.
+    """
+    metrics = _metrics()
+    if metrics is not None:
+        metrics["phases"][name] += seconds
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """
+    Adds the time spent in the block to the current stage's `name` phase.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - started)
+
+
+def count(key: str, n: int = 1) -> None:
+    """
+    Counts documents read from upstreams, or written or skipped as unchanged.
+    """
+    metrics = _metrics()
+    if metrics is not None:
+        metrics["documents"][key] += n
+
+
+def record_upstream(host: str, seconds: float) -> None:
+    """
+    Records how long one upstream took to answer (up to the response headers).
+    """
+    metrics = _metrics()
+    if metrics is not None:
+        metrics["upstream"].setdefault(host, []).append(seconds)
+        metrics["phases"]["fetch"] += seconds
+
+
+def note_error(error: BaseException) -> None:
+    """
+    Counts an error a job handled itself, by class, so it still shows up in the run history.
+    """
+    metrics = _metrics()
+    if metrics is not None:
+        errors = metrics["errors"]
+        errors[type(error).__name__] = errors.get(type(error).__name__, 0) + 1
+
+
+def summarize(metrics: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replaces the raw upstream latencies with count and p50/p95/max in milliseconds.
+    """
+    # A list rather than keyed by host: host names contain dots
+    upstream = [{"host": host, "requests": len(samples),
+                 "p50_ms": percentile(samples, 50) * 1000,
+                 "p95_ms": percentile(samples, 95) * 1000,
+                 "max_ms": max(samples) * 1000}
+                for host, samples in metrics["upstream"].items()]
+    return {**metrics, "upstream": upstream}
+
+
+def run_document(run: JobRun) -> Dict[str, Any]:
+    """
+    Builds the job_runs document for a finished run: its timing and outcome, and
+    per stage the status, phase durations, documents and upstream latency.
+    """
+    ended_at = datetime.now(timezone.utc)
+    duration = run.elapsed()
+    stages: Dict[str, Dict[str, Any]] = {}
+    for name in list(run.stages) + [name for name in run.metrics if name not in run.stages]:
+        stage = dict(run.stages.get(name, {}))
+        if name in run.metrics:
+            stage.update(summarize(run.metrics[name]))
+        stages[name] = stage
+
+    documents = {"read": 0, "written": 0, "skipped": 0}
+    for metrics in run.metrics.values():
+        for key, value in metrics["documents"].items():
+            documents[key] += value
+
+    return {
+        "job_id": run.job_id,
+        "status": run.status,
+        "started_at": ended_at - timedelta(seconds=duration),
+        "ended_at": ended_at,
+        "duration_seconds": duration,
+        "partial_reasons": run.partial_reasons,
+        "error_class": type(run.error).__name__ if run.error is not None else None,
+        "error": str(run.error) if run.error is not None else None,
+        "documents": documents,
+        "stages": stages,
+    }
@@ -1,74 +1,256 @@
 import asyncio
+from apscheduler.events import (
+    EVENT_JOB_ERROR,
+    EVENT_JOB_MAX_INSTANCES,
+    EVENT_JOB_MISSED,
+    EVENT_JOB_SUBMITTED,
+)
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+import functools
 import logging
+import os
+from yarl import URL
+from db.change_detection import change_detector
+from db.monitoring import percentile, tag_queries
+from db.repositories import JobRunRepository
+from db.write_buffer import write_buffer
+from tasks.deadline import (
+    CANCELLED,
+    COMPLETED,
+    FAILED,
+    JOB_CANCEL_GRACE_SECONDS,
+    JOB_DEADLINE_SECONDS,
+    TIMED_OUT,
+    JobRun,
+    job_run,
+)
+from tasks.leader import LEADER_ELECTION_ENABLED, scheduler_leader
+from tasks.pipeline import OK, Stage, TickGraph
+from tasks.run_metrics import run_document
 
 # Import all functions from data_fetch.py
 from tasks.data_fetch import (
+    COINGECKO_API_URL,
+    INVESTORS_API_URL,
+    REDDIT_API_URL,
+    REDDIT_TOKEN_URL,
     fetch_prices,
     fetch_and_store_social_data,
     fetch_investors,
     filter_currencies_based_on_params,
-    save_prices_to_db,
     store_investor_data,
     store_filtered_currencies,
 )
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
+# A run that can't start within this long of its fire time is dropped, not run late
+SCHEDULER_MISFIRE_GRACE_SECONDS = int(os.getenv("SCHEDULER_MISFIRE_GRACE_SECONDS", "60"))
+# Stages running at once across the scheduler, however many the tick graph would allow
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "3"))
+# Number of recent fire lags kept per job for percentiles
+SCHEDULER_LAG_SAMPLES = 100
+
 # Initialize the scheduler
-scheduler = AsyncIOScheduler()
+scheduler = AsyncIOScheduler(job_defaults={
+    # Fire times missed while the loop was busy collapse into a single run
+    "coalesce": True,
+    # A run still going when the next one is due makes that one skip
+    "max_instances": 1,
+    "misfire_grace_time": SCHEDULER_MISFIRE_GRACE_SECONDS,
+})
+
+# Upstream hosts each stage calls; the stage is skipped while any of their circuits is open.
+# The price stage isn't given any: it falls back across price sources instead.
+_coingecko = [URL(COINGECKO_API_URL).host]
+_reddit = [URL(REDDIT_TOKEN_URL).host, URL(REDDIT_API_URL).host]
+_investors = [URL(INVESTORS_API_URL).host]
+
+# Every 10 minute tick: each upstream is fetched once and its result handed to the
+# stages that store it
+TICK_INTERVAL_MINUTES = 10
+# The first tick fires this long after startup, and every tick up to TICK_JITTER_SECONDS late
+TICK_START_OFFSET_SECONDS = float(os.getenv("TICK_START_OFFSET_SECONDS", "30"))
+TICK_JITTER_SECONDS = int(os.getenv("TICK_JITTER_SECONDS", "20"))
+# Stages fetching from different upstreams start staggered rather than all at once
+TICK_GRAPH = TickGraph([
+    Stage('markets', filter_currencies_based_on_params, upstreams=_coingecko,
+          min_price=0.1, max_price=10),
+    Stage('store_markets', store_filtered_currencies, needs={'currencies': 'markets'}),
+    # Prices the coins of the listing fetched just before
+    Stage('prices', fetch_prices, after=['markets']),
+    Stage('social', fetch_and_store_social_data, upstreams=_reddit, offset=15, jitter=10),
+    Stage('investors', fetch_investors, upstreams=_investors, offset=30, jitter=10),
+    Stage('store_investors', store_investor_data, needs={'data': 'investors'}),
+], max_concurrency=SCHEDULER_MAX_CONCURRENCY)
+
+# Off in API processes when `python -m tasks.worker` runs the jobs, so ingestion
+# never shares the API's event loop
+API_RUN_SCHEDULER = os.getenv("API_RUN_SCHEDULER", "true").lower() == "true"
+
+# Per-job timing, kept up to date by scheduler event listeners for the readiness probe
+job_stats: Dict[str, Dict[str, Any]] = {}
+_lag_samples: Dict[str, deque] = {}
+
+
+def _on_job_submitted(event):
+    """
+    Records how late a job started compared to its planned (jittered) fire time,
+    and how many missed fire times were coalesced into this run.
+    """
+    now = datetime.now(timezone.utc)
+    stats = job_stats.setdefault(event.job_id, {})
+    stats["last_submitted_at"] = now
+    stats["lag_seconds"] = (now - event.scheduled_run_times[-1]).total_seconds()
+    stats["coalesced"] = stats.get("coalesced", 0) + len(event.scheduled_run_times) - 1
 
-# Define async wrapper tasks
+    samples = _lag_samples.setdefault(event.job_id, deque(maxlen=SCHEDULER_LAG_SAMPLES))
+    samples.append(stats["lag_seconds"])
+    stats["lag"] = {"p50_seconds": percentile(list(samples), 50),
+                    "p95_seconds": percentile(list(samples), 95),
+                    "max_seconds": max(samples)}
 
 
-async def save_prices_to_db_task():
-    data = await fetch_prices()
-    await save_prices_to_db(data)
+def _on_job_dropped(event):
+    """
+    Counts runs that were dropped: fired past the misfire grace time, or while
+    the previous run was still going.
+    """
+    stats = job_stats.setdefault(event.job_id, {})
+    key = "missed" if event.code == EVENT_JOB_MISSED else "skipped_max_instances"
+    stats[key] = stats.get(key, 0) + 1
+    logger.warning(f"Dropped a run of {event.job_id}: {key}")
+
+
+def _on_job_error(event):
+    """
+    Records the last failed run of each job. Successes are recorded from the run's
+    status in _record_run(), since a run cancelled past its deadline still returns.
+    """
+    stats = job_stats.setdefault(event.job_id, {})
+    stats["last_error_at"] = datetime.now(timezone.utc)
+    stats["last_error"] = repr(event.exception)
+
+
+scheduler.add_listener(_on_job_submitted, EVENT_JOB_SUBMITTED)
+scheduler.add_listener(_on_job_dropped, EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+scheduler.add_listener(_on_job_error, EVENT_JOB_ERROR)
+
+
+def _record_run(job_id: str, run: JobRun) -> None:
+    """
+    Records how the job's last run ended: completed, partial, timed_out, failed or
+    cancelled.
+    """
+    stats = job_stats.setdefault(job_id, {})
+    if run.status == COMPLETED:
+        stats["last_success_at"] = datetime.now(timezone.utc)
+    stats["last_status"] = run.status
+    stats["last_duration_seconds"] = run.elapsed()
+    stats["last_partial_reasons"] = run.partial_reasons
+    runs = stats.setdefault("runs", {})
+    runs[run.status] = runs.get(run.status, 0) + 1
 
 
-async def store_investor_data_task():
-    data = await fetch_investors()
-    await store_investor_data(data)
+async def _store_run(run: JobRun) -> None:
+    """
+    Queues the run for the job_runs history behind GET /api/jobs.
+    """
+    try:
+        await write_buffer.add_inserts(JobRunRepository(), [run_document(run)])
+    except Exception as e:
+        logger.error(f"Failed to record the run of {run.job_id}: {e}")
 
 
-async def store_filtered_currencies_task():
-    # Add min_price and max_price
-    filtered_data = await filter_currencies_based_on_params(min_price=0.1, max_price=10)
-    await store_filtered_currencies(filtered_data)
+async def run_tick():
+    """
+    Runs TICK_GRAPH once and records how each stage went, with the last time it
+    succeeded: the tick job itself rarely fails, since stage errors are caught.
+    """
+    change_detector.start_tick()
+    report = await TICK_GRAPH.run()
+    stages = job_stats.setdefault('tick', {}).setdefault("stages", {})
+    now = datetime.now(timezone.utc)
+    for name, stage_report in report.items():
+        last_success_at = stages.get(name, {}).get("last_success_at")
+        if stage_report["status"] == OK:
+            last_success_at = now
+        stages[name] = {**stage_report, "last_success_at": last_success_at}
 
 # Schedule tasks
 
 
+def tagged(job_id: str, func, deadline: float = JOB_DEADLINE_SECONDS):
+    """
+    Wraps a job so the MongoDB commands it issues are attributed to its id, and
+    so each run is recorded in the job_runs history.
+    The run gets `deadline` seconds: requests are timed to fit in it and work
+    still pending when it passes is dropped. A job still running
+    JOB_CANCEL_GRACE_SECONDS later is cancelled and recorded as timed out.
+    """
+    @functools.wraps(func)
+    async def run(*args, **kwargs):
+        with tag_queries(f"job:{job_id}"), job_run(job_id, deadline) as run:
+            try:
+                async with asyncio.timeout_at(run.ends_at + JOB_CANCEL_GRACE_SECONDS):
+                    return await func(*args, **kwargs)
+            except TimeoutError as e:
+                run.status = TIMED_OUT
+                run.error = e
+                logger.error(f"Cancelled {job_id} after {run.elapsed():.0f}s, past its deadline")
+            except asyncio.CancelledError:
+                run.status = CANCELLED
+                run.partial_reasons.append("cancelled before it finished, e.g. by a shutdown")
+                logger.warning(f"{job_id} was cancelled after {run.elapsed():.0f}s")
+                raise
+            except Exception as e:
+                run.status = FAILED
+                run.error = e
+                raise
+            finally:
+                _record_run(job_id, run)
+                await _store_run(run)
+    return run
+
+
 def configure_scheduler():
     """
     Configures all scheduled jobs.
     """
     logger.debug("Configuring scheduler jobs...")
 
-    # Add the min_price and max_price arguments to the filter_currencies job
-    scheduler.add_job(fetch_prices, 'interval', minutes=10, id='fetch_prices')
-    scheduler.add_job(fetch_and_store_social_data, 'interval',
-                      minutes=10, id='fetch_social_data')
-    scheduler.add_job(fetch_investors, 'interval',
-                      minutes=10, id='fetch_investors')
-    scheduler.add_job(filter_currencies_based_on_params,
-                      'interval',  minutes=10, id='filter_currencies', args=[0, 1])  # Pass min_price, max_price here
-    scheduler.add_job(save_prices_to_db_task, 'interval',
-                      minutes=10, id='save_prices_to_db')
-    scheduler.add_job(store_investor_data_task, 'interval',
-                      minutes=10, id='store_investor_data')
-    scheduler.add_job(store_filtered_currencies_task, 'interval',
-                      minutes=10, id='store_filtered_currencies')
+    # One job runs the whole tick graph; coalescing and max_instances come from job_defaults
+    scheduler.add_job(tagged('tick', run_tick), 'interval',
+                      minutes=TICK_INTERVAL_MINUTES, jitter=TICK_JITTER_SECONDS,
+                      start_date=datetime.now(timezone.utc) +
+                      timedelta(seconds=TICK_START_OFFSET_SECONDS),
+                      id='tick')
 
     logger.debug("Scheduler jobs configured successfully.")
 
 
 async def start_scheduler():
     """
-    Starts the scheduler within an asyncio event loop.
+    Starts the scheduler within an asyncio event loop, or resumes it when this
+    process becomes leader again.
     """
+    try:
+        # Load what is already stored so the first tick skips unchanged entities;
+        # after a failover this also picks up what the previous leader wrote
+        await change_detector.seed()
+    except Exception as e:
+        logger.error(f"Error seeding change detector: {e}")
+
+    if scheduler.running:
+        scheduler.resume()
+        logger.info("Scheduler resumed. Background tasks are running.")
+        return
+
     try:
         configure_scheduler()
         scheduler.start()
@@ -77,26 +259,51 @@ async def start_scheduler():
         logger.error(f"Error starting scheduler: {e}")
 
 
-def stop_scheduler():
+async def pause_scheduler():
     """
-    Stops the scheduler gracefully.
+    Stops starting jobs once another process has become leader. A tick already
+    running finishes within its deadline.
     """
+    if scheduler.running:
+        scheduler.pause()
+        logger.info("Scheduler paused. Another process is leader.")
+
+
+async def stop_scheduler():
+    """
+    Stops the scheduler gracefully, hands the leader lease over and flushes any
+    queued ingestion writes.
+    """
+    await scheduler_leader.stop()
     try:
-        scheduler.shutdown(wait=True)
-        logger.info("Scheduler stopped successfully.")
+        if scheduler.running:
+            scheduler.shutdown(wait=True)
+            logger.info("Scheduler stopped successfully.")
     except Exception as e:
         logger.error(f"Error stopping scheduler: {e}")
 
+    try:
+        await write_buffer.close()
+        logger.info(
+            f"Write buffer flushed: {write_buffer.stats}, {write_buffer.written}")
+    except Exception as e:
+        logger.error(f"Error flushing write buffer: {e}")
+
 # Ensure that the scheduler runs asynchronously for FastAPI or standalone execution
 
 
 def init_scheduler():
     """
-    Initializes the scheduler to be called in a synchronous context.
+    Initializes the scheduler to be called in a synchronous context. With leader
+    election on, only the process holding the scheduler lease runs the jobs.
     """
-    asyncio.create_task(start_scheduler())
+    if LEADER_ELECTION_ENABLED:
+        scheduler_leader.start(on_elected=start_scheduler, on_demoted=pause_scheduler)
+    else:
+        asyncio.create_task(start_scheduler())
 
 
 if __name__ == "__main__":
-    # Start the scheduler in a standalone way
-    asyncio.run(start_scheduler())
+    # Kept for existing deployments; tasks.worker is the standalone entry point
+    from tasks.worker import main
+    main()
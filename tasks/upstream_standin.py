@@ -0,0 +1,387 @@
+"""
+Local stand-in for the CoinGecko, exchange ticker, Reddit and investor APIs, for
+benchmarks and load tests of the ingestion jobs without touching the real upstreams.
+
+Responses are built from the fixtures in tasks/fixtures (small samples in each
+API's response shape; `record` replaces them with live captures), scaled up to
+the requested number of coins and posts. Latency, errors, 429 bursts and Reddit
+quota headers come from a fault profile and can be overridden per flag.
+
+    python -m tasks.upstream_standin serve --profile flaky --coins 10000 --posts 5000
+    python -m tasks.upstream_standin record
+
+Point the fetchers at it with:
+
+    COINGECKO_API_URL=http://127.0.0.1:8900/api/v3
+    BINANCE_API_URL=http://127.0.0.1:8900
+    OKX_API_URL=http://127.0.0.1:8900
+    REDDIT_TOKEN_URL=http://127.0.0.1:8900/api/v1/access_token
+    REDDIT_API_URL=http://127.0.0.1:8900
+    INVESTORS_API_URL=http://127.0.0.1:8900/investors
+
+Every upstream then shares one host, limited by DEFAULT_RATE_PER_SECOND.
+"""
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# Named fault profiles; every value can be overridden by the matching flag
+FAULT_PROFILES: Dict[str, Dict[str, Any]] = {
+    "healthy": {"latency_median_ms": 40, "latency_sigma": 0.3, "error_rate": 0.0,
+                "burst_every": 0, "burst_length": 0, "retry_after": 1, "reddit_quota": 0},
+    "flaky": {"latency_median_ms": 150, "latency_sigma": 0.8, "error_rate": 0.05,
+              "burst_every": 0, "burst_length": 0, "retry_after": 1, "reddit_quota": 1000},
+    "rate_limited": {"latency_median_ms": 60, "latency_sigma": 0.4, "error_rate": 0.0,
+                     "burst_every": 30, "burst_length": 10, "retry_after": 5, "reddit_quota": 100},
+    "degraded": {"latency_median_ms": 2500, "latency_sigma": 0.9, "error_rate": 0.2,
+                 "burst_every": 50, "burst_length": 5, "retry_after": 10, "reddit_quota": 600},
+    "outage": {"latency_median_ms": 100, "latency_sigma": 0.2, "error_rate": 1.0,
+               "burst_every": 0, "burst_length": 0, "retry_after": 1, "reddit_quota": 0},
+}
+
+# Reddit's quota window; its OAuth clients get about 1000 requests per window
+REDDIT_QUOTA_WINDOW_SECONDS = 600
+
+
+def load_fixture(name: str, fixtures_dir: str = FIXTURES_DIR) -> Any:
+    with open(os.path.join(fixtures_dir, name)) as f:
+        return json.load(f)
+
+
+class StandinState:
+    """
+    Generated coin universe and subreddit listings, plus the fault counters.
+    Prices move once per tick, so responses (and ETags) are stable within a tick.
+    """
+
+    def __init__(self, coins: int, posts: int, posts_per_minute: float, tick_seconds: float,
+                 faults: Dict[str, Any], fixtures_dir: str = FIXTURES_DIR, seed: int = 0):
+        self.faults = faults
+        self.tick_seconds = tick_seconds
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.quota_window_started = time.time()
+        self.quota_used = 0
+
+        templates = load_fixture("coins_markets.json", fixtures_dir)
+        self.coins = self._generate_coins(templates, coins)
+        self.coin_index = {coin["id"]: coin for coin in self.coins}
+
+        listing = load_fixture("reddit_listing.json", fixtures_dir)
+        self.post_templates = [child["data"] for child in listing["data"]["children"]]
+        self.posts = posts
+        self.posts_per_minute = posts_per_minute
+        self.started = time.time()
+        self.token = load_fixture("reddit_token.json", fixtures_dir)
+        self.investors = load_fixture("investors.json", fixtures_dir)
+
+    def _generate_coins(self, templates: List[Dict], count: int) -> List[Dict]:
+        coins = []
+        top_cap = max(template["market_cap"] for template in templates)
+        for rank in range(count):
+            template = templates[rank % len(templates)]
+            coin = copy.deepcopy(template)
+            if rank >= len(templates):
+                coin["id"] = f"{template['id']}-{rank}"
+                coin["symbol"] = f"{template['symbol']}{rank}"
+                coin["name"] = f"{template['name']} {rank}"
+                coin["current_price"] = round(10 ** self.rng.uniform(-4, 3), 6)
+            # Market caps fall off with rank, so the listing order matches CoinGecko's
+            coin["market_cap"] = int(top_cap / (rank + 1) ** 1.3)
+            coin["total_volume"] = int(coin["market_cap"] * self.rng.uniform(0.001, 0.2))
+            coin["market_cap_rank"] = rank + 1
+            coins.append(coin)
+        return coins
+
+    def tick(self) -> int:
+        return int(time.time() // self.tick_seconds)
+
+    def price(self, coin: Dict) -> float:
+        """
+        The coin's price in the current tick, drifting within a few percent.
+        """
+        drift = random.Random(f"{self.seed}:{coin['id']}:{self.tick()}").uniform(-0.03, 0.03)
+        return round(coin["current_price"] * (1 + drift), 8)
+
+    def visible_posts(self) -> int:
+        """
+        Number of posts per subreddit so far; new ones arrive at posts_per_minute.
+        """
+        return self.posts + int((time.time() - self.started) / 60 * self.posts_per_minute)
+
+    def post_interval(self) -> float:
+        return 60 / self.posts_per_minute if self.posts_per_minute else 30
+
+    def post(self, subreddit: str, number: int) -> Dict:
+        template = self.post_templates[number % len(self.post_templates)]
+        post = copy.deepcopy(template)
+        post_id = f"{subreddit.lower()}{number:x}"
+        post.update({
+            "id": post_id,
+            "name": f"t3_{post_id}",
+            "subreddit": subreddit,
+            "title": f"{template['title']} #{number}",
+            "created_utc": self.started + (number - self.posts) * self.post_interval(),
+            "ups": random.Random(f"{post_id}:{self.tick()}").randint(0, 5000),
+            "num_comments": random.Random(f"{post_id}:c:{self.tick()}").randint(0, 800),
+        })
+        return post
+
+
+def _json(payload: Any, request: web.Request, headers: Optional[Dict[str, str]] = None,
+          etag: bool = False) -> web.Response:
+    body = json.dumps(payload).encode()
+    headers = dict(headers or {})
+    if etag:
+        tag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        if request.headers.get("If-None-Match") == tag:
+            return web.Response(status=304, headers={"ETag": tag, **headers})
+        headers["ETag"] = tag
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+
+@web.middleware
+async def fault_middleware(request: web.Request, handler):
+    """
+    Applies the fault profile: log-normal latency, 429 bursts, then random 5xx errors.
+    """
+    state: StandinState = request.app["state"]
+    faults = state.faults
+    state.requests += 1
+
+    median = faults["latency_median_ms"] / 1000
+    if median > 0:
+        await asyncio.sleep(state.rng.lognormvariate(0, faults["latency_sigma"]) * median)
+
+    every, length = faults["burst_every"], faults["burst_length"]
+    if every and length and state.requests % (every + length) >= every:
+        return web.json_response({"status": {"error_code": 429, "error_message": "Throttled"}},
+                                 status=429, headers={"Retry-After": str(faults["retry_after"])})
+    if state.rng.random() < faults["error_rate"]:
+        return web.json_response({"error": "stand-in fault"},
+                                 status=state.rng.choice([500, 502, 503]))
+    return await handler(request)
+
+
+async def coins_markets(request: web.Request) -> web.Response:
+    state: StandinState = request.app["state"]
+    per_page = min(int(request.query.get("per_page", 100)), 250)
+    page = max(int(request.query.get("page", 1)), 1)
+    coins = []
+    for coin in state.coins[(page - 1) * per_page:page * per_page]:
+        coin = dict(coin)
+        coin["current_price"] = state.price(coin)
+        coins.append(coin)
+    return _json(coins, request, etag=True)
+
+
+async def simple_price(request: web.Request) -> web.Response:
+    state: StandinState = request.app["state"]
+    prices = {}
+    for coin_id in request.query.get("ids", "").split(","):
+        coin = state.coin_index.get(coin_id)
+        if coin is None:
+            continue
+        prices[coin_id] = {"usd": state.price(coin),
+                           "usd_market_cap": coin["market_cap"],
+                           "usd_24h_vol": coin["total_volume"]}
+    return _json(prices, request, etag=True)
+
+
+def _exchange_quotes(state: StandinState, exchange: str) -> Dict[str, float]:
+    """
+    {SYMBOL: price} as an exchange would quote it, a little off the reference price.
+    """
+    quotes = {}
+    for coin in state.coins:
+        spread = random.Random(f"{exchange}:{coin['id']}:{state.tick()}").uniform(-0.002, 0.002)
+        quotes[coin["symbol"].upper()] = state.price(coin) * (1 + spread)
+    return quotes
+
+
+async def binance_ticker_price(request: web.Request) -> web.Response:
+    quotes = _exchange_quotes(request.app["state"], "binance")
+    return _json([{"symbol": f"{symbol}USDT", "price": f"{price:.8f}"}
+                  for symbol, price in quotes.items()], request)
+
+
+async def okx_tickers(request: web.Request) -> web.Response:
+    quotes = _exchange_quotes(request.app["state"], "okx")
+    return _json({"code": "0", "msg": "",
+                  "data": [{"instType": "SPOT", "instId": f"{symbol}-USDT", "last": f"{price:.8f}"}
+                           for symbol, price in quotes.items()]}, request)
+
+
+async def reddit_token(request: web.Request) -> web.Response:
+    return _json(request.app["state"].token, request)
+
+
+def _reddit_quota_headers(state: StandinState) -> Dict[str, str]:
+    quota = state.faults["reddit_quota"]
+    if not quota:
+        return {}
+    now = time.time()
+    if now - state.quota_window_started >= REDDIT_QUOTA_WINDOW_SECONDS:
+        state.quota_window_started, state.quota_used = now, 0
+    state.quota_used += 1
+    reset = REDDIT_QUOTA_WINDOW_SECONDS - (now - state.quota_window_started)
+    return {"X-Ratelimit-Used": str(state.quota_used),
+            "X-Ratelimit-Remaining": str(max(0, quota - state.quota_used)),
+            "X-Ratelimit-Reset": str(int(reset))}
+
+
+async def reddit_listing(request: web.Request) -> web.Response:
+    state: StandinState = request.app["state"]
+    headers = _reddit_quota_headers(state)
+    if state.faults["reddit_quota"] and state.quota_used > state.faults["reddit_quota"]:
+        return web.json_response({"message": "Too Many Requests", "error": 429},
+                                 status=429, headers=headers)
+
+    subreddit = request.match_info["subreddit"]
+    limit = min(int(request.query.get("limit", 25)), 100)
+    newest = state.visible_posts() - 1
+    start = newest
+    after = request.query.get("after")
+    if after:
+        prefix = f"t3_{subreddit.lower()}"
+        start = int(after[len(prefix):], 16) - 1 if after.startswith(prefix) else -1
+
+    numbers = range(start, max(start - limit, -1), -1)
+    children = [{"kind": "t3", "data": state.post(subreddit, number)} for number in numbers]
+    next_after = children[-1]["data"]["name"] if children and numbers[-1] > 0 else None
+    listing = {"kind": "Listing", "data": {"after": next_after, "dist": len(children),
+                                           "modhash": "", "geo_filter": None,
+                                           "children": children, "before": None}}
+    return _json(listing, request, headers=headers)
+
+
+async def investors(request: web.Request) -> web.Response:
+    return _json(request.app["state"].investors, request)
+
+
+async def stats(request: web.Request) -> web.Response:
+    state: StandinState = request.app["state"]
+    return web.json_response({"requests": state.requests, "faults": state.faults,
+                              "coins": len(state.coins), "posts": state.visible_posts()})
+
+
+def create_app(state: StandinState) -> web.Application:
+    app = web.Application(middlewares=[fault_middleware])
+    app["state"] = state
+    app.router.add_get("/api/v3/coins/markets", coins_markets)
+    app.router.add_get("/api/v3/simple/price", simple_price)
+    app.router.add_get("/api/v3/ticker/price", binance_ticker_price)
+    app.router.add_get("/api/v5/market/tickers", okx_tickers)
+    app.router.add_post("/api/v1/access_token", reddit_token)
+    app.router.add_get("/r/{subreddit}/{listing}", reddit_listing)
+    app.router.add_get("/investors", investors)
+    # Outside the API paths, but still subject to the fault profile
+    app.router.add_get("/_standin/stats", stats)
+    return app
+
+
+async def record(fixtures_dir: str) -> None:
+    """
+    Captures fresh fixtures from the real upstreams through the regular fetch
+    path (rate limiter, breaker, retries). Reddit is only recorded when its
+    credentials are configured.
+    """
+    from tasks.data_fetch import (
+        COINGECKO_API_URL,
+        REDDIT_CLIENT_ID,
+        get_reddit_token,
+        iter_reddit_posts,
+    )
+    from tasks.http_cache import get_json
+    from tasks.http_session import close_session
+
+    def save(name: str, payload: Any) -> None:
+        with open(os.path.join(fixtures_dir, name), "w") as f:
+            json.dump(payload, f, indent=2)
+        logger.info(f"Recorded {name}")
+
+    try:
+        status, coins = await get_json(f"{COINGECKO_API_URL}/coins/markets",
+                                       params={"vs_currency": "usd", "order": "market_cap_desc",
+                                               "per_page": 50, "page": 1,
+                                               "price_change_percentage": "24h"})
+        if status == 200:
+            save("coins_markets.json", coins)
+        else:
+            logger.error(f"Could not record /coins/markets. Status: {status}")
+
+        if REDDIT_CLIENT_ID:
+            token = await get_reddit_token()
+            if token:
+                save("reddit_token.json", {"access_token": "standin-access-token",
+                                           "token_type": "bearer", "expires_in": 86400,
+                                           "scope": "*"})
+                posts = [post async for post in iter_reddit_posts(
+                    "/r/cryptocurrency/new", {"limit": 25, "raw_json": 1})]
+                save("reddit_listing.json", {
+                    "kind": "Listing",
+                    "data": {"after": posts[-1]["name"] if posts else None, "dist": len(posts),
+                             "modhash": "", "geo_filter": None, "before": None,
+                             "children": [{"kind": "t3", "data": post} for post in posts]}})
+    finally:
+        await close_session()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in for the upstream APIs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="serve generated responses")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8900)
+    serve.add_argument("--profile", choices=sorted(FAULT_PROFILES), default="healthy")
+    serve.add_argument("--coins", type=int, default=10_000, help="size of the coin universe")
+    serve.add_argument("--posts", type=int, default=5_000, help="initial posts per subreddit")
+    serve.add_argument("--posts-per-minute", type=float, default=10,
+                       help="new posts per subreddit per minute")
+    serve.add_argument("--tick-seconds", type=float, default=60,
+                       help="how often prices and post scores change")
+    serve.add_argument("--seed", type=int, default=0)
+    for name, default in FAULT_PROFILES["healthy"].items():
+        serve.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=None,
+                           help=f"override the profile's {name}")
+
+    recorder = subparsers.add_parser("record", help="capture fixtures from the real upstreams")
+    for sub in (serve, recorder):
+        sub.add_argument("--fixtures", default=FIXTURES_DIR)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "record":
+        asyncio.run(record(args.fixtures))
+        return
+
+    faults = dict(FAULT_PROFILES[args.profile])
+    for name in faults:
+        override = getattr(args, name)
+        if override is not None:
+            faults[name] = override
+    state = StandinState(args.coins, args.posts, args.posts_per_minute, args.tick_seconds,
+                         faults, fixtures_dir=args.fixtures, seed=args.seed)
+    logger.info(f"Serving {len(state.coins)} coins and {args.posts} posts per subreddit "
+                f"with the '{args.profile}' profile: {faults}")
+    web.run_app(create_app(state), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Standalone ingestion worker: runs the scheduler, the shared HTTP session and the
+write path in a process of its own, so fetching, decoding and validating upstream
+payloads never competes with API requests for the event loop.
+
+    python -m tasks.worker
+
+Run the API with API_RUN_SCHEDULER=false next to it. Both read the same
+environment and write through the same repositories; with leader election on,
+any number of workers can run and only the lease holder runs the jobs.
+"""
+import asyncio
+import logging
+import signal
+
+from db.database import close_client, get_database, init_client
+from db.indexes import ensure_collections, ensure_indexes
+from db.monitoring import ping_sample, sample_ping
+from tasks.http_cache import response_cache
+from tasks.http_session import close_session, init_session
+from tasks.scheduler import init_scheduler, stop_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+async def run_worker():
+    """
+    Runs the scheduled jobs until SIGINT or SIGTERM, then hands the leader lease
+    over, flushes queued writes and closes the shared clients.
+    """
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    init_client()
+    init_session()
+    response_cache.load()
+    db = get_database()
+
+    await sample_ping(db)
+    if not ping_sample["ok"]:
+        logger.error(f"Error connecting to MongoDB: {ping_sample['error']}")
+    else:
+        try:
+            # The worker may start before the API: job_runs must be created capped
+            await ensure_collections(db)
+            await ensure_indexes(db)
+        except Exception as e:
+            logger.error(f"Error creating MongoDB indexes: {e}")
+
+    init_scheduler()
+    logger.info("Ingestion worker started.")
+    try:
+        await stopping.wait()
+        logger.info("Ingestion worker stopping...")
+    finally:
+        await stop_scheduler()
+        response_cache.save()
+        await close_session()
+        close_client()
+
+
+def main():
+    asyncio.run(run_worker())
+
+
+if __name__ == "__main__":
+    main()
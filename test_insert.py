@@ -8,7 +8,7 @@ async def insert_and_check_data():
     """
     try:
         # Get the database instance
-        db = await get_database()
+        db = get_database()
 
         # Define the sample data to insert
         sample_data = {
@@ -1,6 +1,16 @@
 import asyncio
+from db.write_buffer import write_buffer
 from tasks.data_fetch import fetch_and_store_social_data
+from tasks.http_session import close_session
+
+
+async def main():
+    try:
+        await fetch_and_store_social_data()
+        await write_buffer.close()
+    finally:
+        await close_session()
 
 
 if __name__ == "__main__":
-    asyncio.run(fetch_and_store_social_data())
+    asyncio.run(main())